@@ -0,0 +1,320 @@
+"""End-to-end federated round benchmark with per-stage timings.
+
+Builds a synthetic corpus, then runs real DataProcessor / FLClient / FLServer
+rounds against a ledger and records where the time goes:
+
+    encoding, dataset_build, keygen,
+    gradient, serialization, signing, encryption   (per client, FLClient.train_round)
+    ledger_write                                    (store_updates_bulk)
+    ledger_read, decryption, verification, decode,
+    aggregation                                     (FLServer.aggregate_updates)
+    evaluation
+
+Every combination of the swept parameters is one result. Results are written as
+JSON. The default ledger is an in-memory stand-in for DBManager, so the benchmark
+runs offline. --db sqlite runs the real DBManager on the embedded SQLite backend
+(in memory unless --db-path is given), still with no external service; --db mysql
+uses the MySQL backend (DB_* environment variables).
+
+Example:
+    python benchmarks/round_benchmark.py --clients 2,5,10 --seq-length 20,40 \\
+        --vocab 30,60 --samples 500,2000 --rounds 3 --output results.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from src.data_processing import DataProcessor
+from src.client import FLClient
+from src.server import FLServer
+from src.security import KeyManager
+
+# Stage names in the order a round runs them
+CLIENT_STAGES = ("gradient", "serialization", "signing", "encryption")
+# FLServer.last_aggregation_stats key -> benchmark stage
+SERVER_STAGES = {
+    "fetch": "ledger_read",
+    "decrypt": "decryption",
+    "verify": "verification",
+    "decode": "decode",
+    "fold": "aggregation",
+}
+
+
+class MemoryLedger:
+    """In-process stand-in for DBManager, implementing what a round uses.
+
+    Rows are kept as the same base64 strings MySQL would store, so ledger
+    stages measure copying and lookup but no network or disk.
+    """
+    def __init__(self):
+        self.clients = {}
+        self.updates = []
+        self.models = []
+        self.round_id = 0
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    @contextmanager
+    def round_transaction(self):
+        yield self
+
+    def register_clients_bulk(self, clients):
+        for client_id, public_key in clients:
+            self.clients.setdefault(client_id, public_key)
+
+    def get_client_public_keys(self, client_ids):
+        return {c: self.clients[c] for c in client_ids if c in self.clients}
+
+    def start_round(self):
+        self.round_id += 1
+        return self.round_id
+
+    def store_updates_bulk(self, updates, batch_size=32):
+        self.updates.extend(updates)
+
+    def iter_updates_with_keys(self, round_id, batch_size=16):
+        for row in self.updates:
+            if row[0] == round_id:
+                yield tuple(row[1:]) + (self.clients.get(row[1]),)
+
+    def store_global_model(self, round_id, model_data, accuracy, base_round_id=None):
+        self.models.append((round_id, model_data, accuracy, base_round_id))
+
+
+def open_ledger(kind, path=None):
+    if kind == "memory":
+        return MemoryLedger()
+    from src.db_manager import DBManager
+    from src.storage import MySQLBackend, SQLiteBackend
+    backend = SQLiteBackend(path or ":memory:") if kind == "sqlite" else MySQLBackend()
+    db = DBManager(backend=backend)
+    db.connect()
+    if kind == "sqlite" and not path:
+        # The in-memory ledger is shared by the whole process; start each config
+        # from an empty one so it doesn't see the last config's clients and keys
+        db.reset_database()
+    return db
+
+
+def synthetic_corpus(path, num_chars, vocab_size, seed=0):
+    """Text over vocab_size distinct characters, made of words from a random lexicon.
+
+    Word structure gives the model something learnable, unlike uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    # Space separates words; the rest of the alphabet is letters, digits, punctuation...
+    alphabet = np.array([" "] + [chr(c) for c in range(33, 33 + vocab_size - 1)])
+    lexicon = ["".join(rng.choice(alphabet[1:], size=rng.integers(2, 8))) for _ in range(500)]
+    # Every character must occur so the vocab is exactly vocab_size
+    words = ["".join(alphabet[1:])]
+    length = len(words[0])
+    while length < num_chars:
+        word = lexicon[rng.integers(len(lexicon))]
+        words.append(word)
+        length += len(word) + 1
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(" ".join(words)[:num_chars])
+
+
+class StageTimes:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        t = time.perf_counter()
+        yield
+        self.add(stage, time.perf_counter() - t)
+
+    def summary(self):
+        return {
+            stage: {
+                "total": float(np.sum(values)),
+                "mean": float(np.mean(values)),
+                "min": float(np.min(values)),
+                "max": float(np.max(values)),
+                "count": len(values),
+            }
+            for stage, values in self.samples.items()
+        }
+
+
+def run_config(num_clients, seq_length, vocab_size, samples_per_client, args, work_dir,
+               client_prefix="client"):
+    """One benchmark run; returns its result dict.
+
+    Client ids are client_prefix_1, client_prefix_2...; give every run and config its
+    own prefix on a persistent ledger, which keeps the first public key registered
+    for an id.
+    """
+    times = StageTimes()
+    stride = args.stride
+    # Enough text for samples_per_client windows per client, plus a held-out test slice
+    chars_per_client = samples_per_client * stride + seq_length + 1
+    corpus_path = os.path.join(work_dir, f"corpus_{vocab_size}_{num_clients}_{samples_per_client}_{seq_length}.txt")
+    synthetic_corpus(corpus_path, chars_per_client * (num_clients + 1), vocab_size, seed=args.seed)
+
+    np.random.seed(args.seed)
+    processor = DataProcessor(corpus_path, seq_length=seq_length, stride=stride,
+                              cache_dir=os.path.join(work_dir, "cache"))
+    with times.time("encoding"):
+        processor.load_data()
+
+    partitions = processor.partition_data(num_clients + 1)
+    test_part = partitions[-1]
+    with times.time("dataset_build"):
+        for part in partitions[:-1]:
+            processor.create_dataset(part)
+    test_X, test_y = processor.create_dataset(test_part)
+
+    shared_key = KeyManager.generate_shared_key()
+    clients = []
+    for i in range(num_clients):
+        with times.time("keygen"):
+            clients.append(FLClient(
+                f"{client_prefix}_{i+1}", partitions[i], processor, shared_key,
+                epochs=args.epochs, batch_size=args.batch_size, update_codec=args.codec
+            ))
+
+    db = open_ledger(args.db, args.db_path)
+    server = FLServer(processor.vocab_size, processor.seq_length, db, shared_key,
+                      dtype=args.dtype)
+    server.register_clients(clients)
+
+    update_bytes, ciphertext_chars = [], []
+    round_seconds = []
+    loss = accuracy = None
+    try:
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            with db.round_transaction():
+                round_id = db.start_round()
+                W, b = server.global_model.get_parameters()
+
+                rows = []
+                for client in clients:
+                    pkg = client.train_round(W, b, round_id)
+                    for stage in CLIENT_STAGES:
+                        times.add(stage, client.last_round_stats[stage])
+                    update_bytes.append(client.last_round_stats["update_bytes"])
+                    ciphertext_chars.append(len(pkg["encrypted_data"]))
+                    rows.append((round_id, pkg["client_id"], pkg["encrypted_data"],
+                                 pkg["nonce"], pkg["tag"], pkg["signature"]))
+
+                with times.time("ledger_write"):
+                    db.store_updates_bulk(rows)
+
+                server.aggregate_updates(round_id)
+                stats = server.last_aggregation_stats
+                if stats["valid"] == 0:
+                    raise RuntimeError(f"Round {round_id} aggregated none of its {stats['updates']} "
+                                       f"updates; its timings would be meaningless")
+                for key, stage in SERVER_STAGES.items():
+                    times.add(stage, stats.get(key, 0.0))
+
+                with times.time("evaluation"):
+                    loss, accuracy = server.evaluate(test_X, test_y)
+            round_seconds.append(time.perf_counter() - started)
+    finally:
+        db.close()
+
+    return {
+        "params": {
+            "num_clients": num_clients,
+            "seq_length": seq_length,
+            "vocab_size": processor.vocab_size,
+            "samples_per_client": int(clients[0].X_indices.shape[0]),
+        },
+        "stages": times.summary(),
+        "round_seconds": {
+            "mean": float(np.mean(round_seconds)),
+            "total": float(np.sum(round_seconds)),
+        },
+        "update_bytes_mean": float(np.mean(update_bytes)),
+        "ciphertext_chars_mean": float(np.mean(ciphertext_chars)),
+        "final_loss": float(loss),
+        "final_accuracy": float(accuracy),
+    }
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage timing of federated learning rounds")
+    parser.add_argument("--clients", type=int_list, default=[5], help="comma-separated num_clients values")
+    parser.add_argument("--seq-length", type=int_list, default=[40])
+    parser.add_argument("--vocab", type=int_list, default=[60], help="synthetic corpus vocab sizes")
+    parser.add_argument("--samples", type=int_list, default=[1000], help="training windows per client")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--stride", type=int, default=3)
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--codec", default=None, help="update codec (see src/compression.py); default full weights")
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--db", choices=("memory", "sqlite", "mysql"), default="memory")
+    parser.add_argument("--db-path", help="SQLite file for --db sqlite (default: in memory)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON output path (default: stdout)")
+    parser.add_argument("--verbose", action="store_true", help="show client/server log output")
+    args = parser.parse_args(argv)
+
+    results = []
+    sweep = list(itertools.product(args.clients, args.seq_length, args.vocab, args.samples))
+    # Unique per run, so reruns against the same ledger don't reuse registered clients
+    run_tag = f"bench{int(time.time())}_{os.getpid()}"
+    with tempfile.TemporaryDirectory(prefix="fl_bench_") as work_dir:
+        for i, (num_clients, seq_length, vocab_size, samples) in enumerate(sweep, 1):
+            print(f"[{i}/{len(sweep)}] clients={num_clients} seq_length={seq_length} "
+                  f"vocab={vocab_size} samples={samples}", file=sys.stderr)
+            log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with log:
+                results.append(run_config(num_clients, seq_length, vocab_size, samples, args, work_dir,
+                                          client_prefix=f"{run_tag}_cfg{i}_client"))
+
+    report = {
+        "benchmark": "round",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "verbose")},
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
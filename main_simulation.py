@@ -3,6 +3,8 @@ from src.data_processing import DataProcessor
 from src.client import FLClient
 from src.server import FLServer
 from src.security import KeyManager
+from src.parallel import make_client_trainer
+import os
 import time
 
 def main():
@@ -31,11 +33,17 @@ def main():
     # 4. Create Clients
     print("\n--- Phase 3: Client Initialization ---")
     NUM_CLIENTS = 5
+    # Local training per round: epochs of mini-batch SGD (batch size 0 = full batch)
+    LOCAL_EPOCHS = int(os.getenv('FL_LOCAL_EPOCHS', 1))
+    BATCH_SIZE = int(os.getenv('FL_BATCH_SIZE', 0)) or None
+    # Upload compressed deltas instead of full weights: none, int8, topk or topk+int8
+    UPDATE_CODEC = os.getenv('FL_UPDATE_CODEC') or None
     client_partitions = processor.partition_data(NUM_CLIENTS)
     clients = []
     
     for i in range(NUM_CLIENTS):
-        c = FLClient(f"client_{i+1}", client_partitions[i], processor, shared_key)
+        c = FLClient(f"client_{i+1}", client_partitions[i], processor, shared_key,
+                     epochs=LOCAL_EPOCHS, batch_size=BATCH_SIZE, update_codec=UPDATE_CODEC)
         clients.append(c)
         print(f"Initialized Client {c.client_id}")
 
@@ -45,42 +53,47 @@ def main():
     server.register_clients(clients) # Register public keys on DB
     
     # Prepare Test Data (Use a small chunk of text from the first client for simple validation)
-    test_X_ind, test_y = processor.create_dataset(client_partitions[0][-200:]) # Last 200 chars
-    test_X = processor.one_hot_encode(test_X_ind)
+    test_X, test_y = processor.create_dataset(client_partitions[0][-200:]) # Last 200 chars (index inputs)
     
     # 6. Training Loop
     print("\n--- Phase 5: Federated Training Loop ---")
     NUM_ROUNDS = 3
-    
-    for r in range(1, NUM_ROUNDS + 1):
-        print(f"\n[Round {r}] Starting...")
-        round_id = db.start_round()
+    # Worker processes for client training (1 = sequential, 0 = one per CPU core)
+    NUM_WORKERS = int(os.getenv('FL_TRAIN_WORKERS', 1)) or None
+    # Closed even if a round fails, so worker processes and shared memory don't leak
+    with make_client_trainer(clients, NUM_WORKERS) as trainer:
+        for r in range(1, NUM_ROUNDS + 1):
+            print(f"\n[Round {r}] Starting...")
+            # The round is committed on its own so other writers aren't blocked while clients train
+            round_id = db.start_round()
+        
+            # Get current global params
+            curr_W, curr_b = server.global_model.get_parameters()
         
-        # Get current global params
-        curr_W, curr_b = server.global_model.get_parameters()
+            # Clients Download -> Train -> Encrypt -> Sign -> Upload
+            updates = []
+            for update_pkg in trainer.train_round(curr_W, curr_b, round_id):
+                print(f"  > Client {update_pkg['client_id']} trained and uploaded secure update.")
+                updates.append((
+                    round_id,
+                    update_pkg["client_id"],
+                    update_pkg["encrypted_data"],
+                    update_pkg["nonce"],
+                    update_pkg["tag"],
+                    update_pkg["signature"]
+                ))
         
-        # Clients Download -> Train -> Encrypt -> Sign -> Upload
-        for client in clients:
-            print(f"  > Client {client.client_id} training...")
-            update_pkg = client.train_round(curr_W, curr_b)
-            
-            # Upload to DB ("The Ledger")
-            db.store_update(
-                round_id, 
-                update_pkg["client_id"],
-                update_pkg["encrypted_data"],
-                update_pkg["nonce"],
-                update_pkg["tag"],
-                update_pkg["signature"]
-            )
-            print(f"  > Client {client.client_id} uploaded secure update.")
-            
-        # Server Aggregates
-        print(f"  > Server aggregating updates...")
-        server.aggregate_updates(round_id)
+            # The round's updates and aggregation are committed together
+            with db.round_transaction():
+                # Upload to DB ("The Ledger") in multi-row batches
+                db.store_updates_bulk(updates)
+                
+                # Server Aggregates
+                print(f"  > Server aggregating updates...")
+                server.aggregate_updates(round_id)
         
-        # Evaluation
-        server.evaluate(test_X, test_y)
+            # Evaluation
+            server.evaluate(test_X, test_y)
 
     db.close()
     print("\n=== Simulation Complete ===")
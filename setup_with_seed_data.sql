@@ -5,6 +5,8 @@
 USE `nam-project-313937c3b4`;
 
 -- 2. Create Tables (if they don't exist)
+-- Indexes and later schema changes are applied by DBManager's versioned
+-- migrations (schema_migrations table) the first time the app connects.
 
 -- Clients Table
 CREATE TABLE IF NOT EXISTS clients (
@@ -0,0 +1,82 @@
+import numpy as np
+
+class StreamingFedAvg:
+    """Sample-weighted FedAvg that folds in one update at a time.
+
+    Each update is added to a running float64 weighted sum as soon as it is decoded
+    and can then be released, so memory stays O(model size) however many clients
+    participate.
+
+    Updates may be full weights (add) or deltas from base, the global model the
+    round started from (add_delta, add_sparse_delta). Deltas are summed in the
+    same buffer and base is added back once, in result().
+    """
+    def __init__(self, base=None):
+        # base: (W, b) that deltas are relative to
+        self.base = base
+        self.sum_W = None
+        self.sum_b = None
+        self._scratch_W = None
+        self.total_weight = 0.0
+        self.delta_weight = 0.0
+        self.count = 0
+
+    def add(self, W, b, weight=1.0):
+        """Fold one update into the running sum, weighted by its sample count"""
+        if weight <= 0:
+            return
+        self._check_shape(W.shape, b.shape)
+        
+        # sum += weight * W without allocating a temporary per update
+        np.multiply(W, weight, out=self._scratch_W)
+        self.sum_W += self._scratch_W
+        self.sum_b += weight * b
+        self.total_weight += weight
+        self.count += 1
+
+    def add_delta(self, dW, db, weight=1.0):
+        """Fold in a dense delta from base"""
+        if weight <= 0:
+            return
+        self._require_base()
+        self.add(dW, db, weight)
+        self.delta_weight += weight
+
+    def add_sparse_delta(self, indices, values, shape, db, weight=1.0):
+        """Fold in a delta given as flat indices into W and their values (zero elsewhere)"""
+        if weight <= 0:
+            return
+        self._require_base()
+        self._check_shape(shape, db.shape)
+        # Top-k indices are unique, so a plain fancy-index add is exact
+        self.sum_W.reshape(-1)[indices] += weight * values
+        self.sum_b += weight * db
+        self.total_weight += weight
+        self.delta_weight += weight
+        self.count += 1
+
+    def result(self):
+        """Weighted average (W, b), or (None, None) if nothing was added"""
+        if self.count == 0:
+            return None, None
+        W, b = self.sum_W / self.total_weight, self.sum_b / self.total_weight
+        if self.delta_weight:
+            share = self.delta_weight / self.total_weight
+            W += share * self.base[0]
+            b += share * self.base[1]
+        return W, b
+
+    def _require_base(self):
+        if self.base is None:
+            raise ValueError("Delta update, but the aggregator has no base model")
+
+    def _check_shape(self, W_shape, b_shape):
+        W_shape, b_shape = tuple(W_shape), tuple(b_shape)
+        if self.sum_W is None:
+            self.sum_W = np.zeros(W_shape, dtype=np.float64)
+            self.sum_b = np.zeros(b_shape, dtype=np.float64)
+            self._scratch_W = np.empty(W_shape, dtype=np.float64)
+        elif W_shape != self.sum_W.shape or b_shape != self.sum_b.shape:
+            raise ValueError(f"Update shape {W_shape}/{b_shape} does not match {self.sum_W.shape}/{self.sum_b.shape}")
+        if self.base is not None and (W_shape != self.base[0].shape or b_shape != self.base[1].shape):
+            raise ValueError(f"Update shape {W_shape}/{b_shape} does not match the global model")
@@ -0,0 +1,163 @@
+import json
+import struct
+import zlib
+import numpy as np
+
+# Binary global-model checkpoint format (little-endian):
+#   header : magic "FLCK", version, dtype code, flags, round_id, base_round_id
+#            (-1 for a full checkpoint), W rows, W cols, b length
+#   payload: W bytes then b bytes in the stored dtype, zlib-compressed if
+#            FLAG_COMPRESSED is set. With FLAG_DELTA the tensors are the difference
+#            from the checkpoint of base_round_id.
+MAGIC = b"FLCK"
+VERSION = 1
+
+FLAG_COMPRESSED = 1
+FLAG_DELTA = 2
+
+# Padded to 32 bytes so uncompressed tensors start 8-byte aligned
+_HEADER = struct.Struct("<4sBBBxiiIII4x")
+
+DTYPE_CODES = {
+    np.dtype('<f8'): 1,
+    np.dtype('<f4'): 2,
+    np.dtype('<f2'): 3,
+}
+CODE_DTYPES = {code: dtype for dtype, code in DTYPE_CODES.items()}
+
+
+class CheckpointError(ValueError):
+    pass
+
+
+def is_checkpoint(blob):
+    return blob is not None and bytes(blob[:len(MAGIC)]) == MAGIC
+
+
+def encode_checkpoint(W, b, round_id, dtype=None, compress=True, base=None):
+    """Serialize W, b to a checkpoint blob.
+
+    dtype: stored dtype (default: W's own); float16 halves a float32 model again.
+    base: optional (base_round_id, base_W, base_b) to store a delta against.
+    """
+    dtype = np.dtype(dtype or W.dtype).newbyteorder('<')
+    if dtype not in DTYPE_CODES:
+        raise CheckpointError(f"Unsupported dtype {dtype}")
+    
+    flags = 0
+    base_round_id = -1
+    if base is not None:
+        base_round_id, base_W, base_b = base
+        W = W - base_W
+        b = b - base_b
+        flags |= FLAG_DELTA
+    
+    payload = np.ascontiguousarray(W, dtype=dtype).tobytes() + np.ascontiguousarray(b, dtype=dtype).tobytes()
+    if compress:
+        payload = zlib.compress(payload, 6)
+        flags |= FLAG_COMPRESSED
+    
+    header = _HEADER.pack(MAGIC, VERSION, DTYPE_CODES[dtype], flags, round_id, base_round_id,
+                          W.shape[0], W.shape[1], b.shape[0])
+    return header + payload
+
+
+def read_header(blob):
+    """Returns the header fields as a dict without decoding the tensors"""
+    if len(blob) < _HEADER.size:
+        raise CheckpointError("Checkpoint too short")
+    magic, version, dtype_code, flags, round_id, base_round_id, rows, cols, bias_len = \
+        _HEADER.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise CheckpointError("Not a binary checkpoint")
+    if version != VERSION:
+        raise CheckpointError(f"Unsupported checkpoint version {version}")
+    if dtype_code not in CODE_DTYPES:
+        raise CheckpointError(f"Unknown dtype code {dtype_code}")
+    return {
+        "dtype": CODE_DTYPES[dtype_code],
+        "compressed": bool(flags & FLAG_COMPRESSED),
+        "delta": bool(flags & FLAG_DELTA),
+        "round_id": round_id,
+        "base_round_id": base_round_id if flags & FLAG_DELTA else None,
+        "shapes": ((rows, cols), (bias_len,)),
+    }
+
+
+def decode_checkpoint(blob, base=None):
+    """Parse a checkpoint blob into (round_id, W, b).
+
+    Uncompressed full checkpoints are read-only np.frombuffer views of blob. Delta
+    checkpoints need base=(base_W, base_b) of the base round.
+    """
+    header = read_header(blob)
+    dtype = header["dtype"]
+    (rows, cols), (bias_len,) = header["shapes"]
+    
+    payload = memoryview(blob)[_HEADER.size:]
+    if header["compressed"]:
+        payload = zlib.decompress(payload)
+    if len(payload) != (rows * cols + bias_len) * dtype.itemsize:
+        raise CheckpointError("Checkpoint payload size does not match header")
+    
+    W = np.frombuffer(payload, dtype=dtype, count=rows * cols).reshape(rows, cols)
+    b = np.frombuffer(payload, dtype=dtype, count=bias_len, offset=rows * cols * dtype.itemsize)
+    
+    if header["delta"]:
+        if base is None:
+            raise CheckpointError(f"Delta checkpoint needs round {header['base_round_id']} as base")
+        base_W, base_b = base
+        W = base_W + W
+        b = base_b + b
+    return header["round_id"], W, b
+
+
+class CheckpointWriter:
+    """Encodes successive global models, storing most of them as deltas.
+
+    Every keyframe_interval-th checkpoint is a full one, which bounds the chain a
+    loader has to replay. Deltas are taken against the *decoded* previous
+    checkpoint, so lossy dtypes do not accumulate drift along the chain.
+    """
+    def __init__(self, dtype=None, compress=True, use_delta=True, keyframe_interval=10):
+        self.dtype = dtype
+        self.compress = compress
+        self.use_delta = use_delta
+        self.keyframe_interval = keyframe_interval
+        self._previous = None # (round_id, W, b) as a loader would reconstruct it
+        self._chain_length = 0
+
+    def encode(self, W, b, round_id):
+        """Returns (blob, base_round_id); base_round_id is None for full checkpoints"""
+        base = None
+        if self.use_delta and self._previous is not None and self._chain_length < self.keyframe_interval - 1:
+            base = self._previous
+        
+        blob = encode_checkpoint(W, b, round_id, dtype=self.dtype, compress=self.compress, base=base)
+        decoded = decode_checkpoint(blob, base=base[1:] if base else None)
+        self._previous = (round_id, np.array(decoded[1]), np.array(decoded[2]))
+        self._chain_length = self._chain_length + 1 if base else 0
+        return blob, (base[0] if base else None)
+
+
+def restore_chain(rows):
+    """Rebuild (round_id, W, b) from checkpoint rows.
+
+    rows: [(round_id, model_data, model_blob), ...] ordered from the full checkpoint
+    to the target, as returned by DBManager.get_checkpoint_chain. Legacy rows with
+    JSON model_data are accepted as full checkpoints.
+    """
+    state = None
+    for round_id, model_data, model_blob in rows:
+        if is_checkpoint(model_blob):
+            round_id, W, b = decode_checkpoint(model_blob, base=state[1:] if state else None)
+        else:
+            try:
+                data = json.loads(model_data)
+                W, b = np.array(data["W"]), np.array(data["b"])
+            except (TypeError, ValueError, KeyError) as e:
+                raise CheckpointError(f"Unreadable JSON checkpoint for round {round_id}: {e}")
+        state = (round_id, W, b)
+    if state is None:
+        raise CheckpointError("No checkpoint found")
+    return state
@@ -1,63 +1,139 @@
-import json
+import time
 import numpy as np
 from src.security import KeyManager, CryptoModule
 from src.model import LogisticRegressionModel
+from src.wire_format import encode_update, encode_delta_update
+from src.compression import ErrorFeedback, codec_id
+from src.metrics import REGISTRY, SIZE_BUCKETS
+
+STAGES = ("gradient", "serialization", "signing", "encryption")
+_STAGE_SECONDS = REGISTRY.histogram(
+    "fl_client_stage_seconds", "Time spent in each stage of FLClient.train_round", ["stage"])
+_STAGE_TIMERS = tuple((stage, _STAGE_SECONDS.labels(stage)) for stage in STAGES)
+_UPDATE_BYTES = REGISTRY.histogram(
+    "fl_client_update_bytes", "Serialized update size before encryption", buckets=SIZE_BUCKETS).labels()
+_ROUNDS = REGISTRY.counter("fl_client_rounds_total", "Completed FLClient.train_round calls").labels()
+
+
+def record_round_stats(stats):
+    """Adds one train_round's last_round_stats to the process metrics"""
+    for stage, timer in _STAGE_TIMERS:
+        timer.observe(stats[stage])
+    _UPDATE_BYTES.observe(stats["update_bytes"])
+    _ROUNDS.inc()
+
 
 class FLClient:
-    def __init__(self, client_id, text_data, data_processor, shared_key):
+    def __init__(self, client_id, text_data, data_processor, shared_key,
+                 epochs=1, batch_size=None, learning_rate=0.5, lr_decay=0.0, shuffle=True,
+                 update_codec=None, topk_ratio=0.01, error_feedback=True):
         self.client_id = client_id
         self.text_data = text_data
         self.processor = data_processor
         self.shared_key = shared_key
         
+        # Local training per round: `epochs` passes over the data in mini-batches of
+        # batch_size samples (None = full batch). The step size decays as
+        # learning_rate / (1 + lr_decay * step). The defaults take a single
+        # full-batch step, as the original FedAvg demo did.
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.learning_rate = learning_rate
+        self.lr_decay = lr_decay
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng()
+        self._perm = None
+        self._X_batch = None
+        self._y_batch = None
+        
+        # Upload format: full weights (update_codec=None), or the delta from the global
+        # model compressed with a codec from src/compression.py ("none", "int8",
+        # "topk", "topk+int8"). With error feedback, what a lossy codec drops is
+        # carried into the next round's delta.
+        self.update_codec = update_codec
+        self.feedback = ErrorFeedback(update_codec, topk_ratio, error_feedback) if update_codec else None
+        
+        # Seconds spent in each stage of the last train_round
+        self.last_round_stats = {}
+        
         # Security Keys
         self.private_key, self.public_key = KeyManager.generate_client_keys()
         self.public_key_str = KeyManager.serialize_public_key(self.public_key)
         
         # Prepare Data
+        # Inputs stay as (num_samples, seq_length) character indices; the model
+        # consumes them directly, so the one-hot matrix is never materialized.
         self.X_indices, self.y = self.processor.create_dataset(self.text_data)
-        # Limit data for performance in simulation
-        if len(self.X_indices) > 500:
-            self.X_indices = self.X_indices[:500]
-            self.y = self.y[:500]
-            
-        self.X = self.processor.one_hot_encode(self.X_indices)
         
         self.model = LogisticRegressionModel(self.processor.vocab_size, self.processor.seq_length)
 
-    def train_round(self, global_weights, global_bias):
-        """Performs local training and returns secured update"""
+    def __getstate__(self):
+        # Key objects cannot be pickled, and the dataset is cheaper to rebuild than to send
+        state = self.__dict__.copy()
+        state["private_key"] = KeyManager.serialize_private_key(self.private_key)
+        del state["public_key"], state["X_indices"], state["y"]
+        state["_perm"] = state["_X_batch"] = state["_y_batch"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.private_key = KeyManager.load_private_key(state["private_key"])
+        self.public_key = self.private_key.public_key()
+        self.X_indices, self.y = self.processor.create_dataset(self.text_data)
+
+    def train_round(self, global_weights, global_bias, round_id=0):
+        """Performs local training and returns secured update.
+
+        Per-stage timings (gradient, serialization, signing, encryption) are kept
+        in last_round_stats and recorded in the process metrics (src/metrics.py).
+        """
+        stats = {}
+        t = time.perf_counter()
         
-        # Update local model with global parameters
-        self.model.set_parameters(global_weights, global_bias)
+        # Update local model with global parameters. Copy them, since training updates
+        # W in place and the caller's arrays may be shared with other clients.
+        self.model.set_parameters(global_weights.copy(), global_bias.copy())
         
         # Train (Compute Gradients)
         # Check if we have data to train on
-        if self.X.shape[0] == 0:
+        if self.X_indices.shape[0] == 0:
             # No data: return zero updates
             new_W, new_b = self.model.get_parameters() # Unchanged
         else:
-            dW, db = self.model.compute_gradients(self.X, self.y)
-            
             # We can simulate local steps by updating and computing diff, or just sending gradients.
             # Standard FedSGD sends gradients. FedAvg sends weights.
             # For simplicity in this demo, let's send WEIGHT UPDATE (new weights)
-            self.model.update_parameters(dW, db, learning_rate=0.5)
+            self.train_local()
             new_W, new_b = self.model.get_parameters()
+        stats["gradient"] = time.perf_counter() - t
+        t = time.perf_counter()
         
-        # Create Update Package
-        update_data = {
-            "W": new_W.tolist(),
-            "b": new_b.tolist(),
-            "client_id": self.client_id
-        }
-        update_json = json.dumps(update_data)
+        # Create Update Package (binary header + raw tensor bytes, see src/wire_format.py)
+        # The sample count lets the server weight this update in FedAvg
+        num_samples = self.X_indices.shape[0]
+        if self.feedback is None:
+            update_bytes = encode_update(self.client_id, round_id, new_W, new_b, num_samples=num_samples)
+        else:
+            delta_W = np.subtract(new_W, global_weights, dtype=new_W.dtype)
+            sections = self.feedback.compress(delta_W)
+            update_bytes = encode_delta_update(
+                self.client_id, round_id, codec_id(self.update_codec), sections, delta_W.shape,
+                np.subtract(new_b, global_bias, dtype=new_b.dtype), num_samples=num_samples
+            )
+        stats["serialization"] = time.perf_counter() - t
+        t = time.perf_counter()
         
         # SECURITY: Sign the update
-        signature = CryptoModule.sign_data(self.private_key, update_json)
+        signature = CryptoModule.sign_data(self.private_key, update_bytes)
+        stats["signing"] = time.perf_counter() - t
+        t = time.perf_counter()
         
         # SECURITY: Encrypt the update
-        encrypted_data, nonce, tag = CryptoModule.encrypt_update(self.shared_key, update_json)
+        encrypted_data, nonce, tag = CryptoModule.encrypt_update(self.shared_key, update_bytes)
+        stats["encryption"] = time.perf_counter() - t
+        stats["update_bytes"] = len(update_bytes)
+        self.last_round_stats = stats
+        record_round_stats(stats)
         
         return {
             "client_id": self.client_id,
@@ -66,3 +142,45 @@ class FLClient:
             "tag": tag,
             "signature": signature
         }
+
+    def train_local(self):
+        """Runs the configured local epochs of mini-batch gradient descent on self.model"""
+        step = 0
+        for _ in range(self.epochs):
+            for X_batch, y_batch in self._batches():
+                dW, db = self.model.compute_gradients(X_batch, y_batch)
+                lr = self.learning_rate / (1.0 + self.lr_decay * step)
+                self.model.update_parameters(dW, db, learning_rate=lr)
+                step += 1
+        return step
+
+    def _batches(self):
+        n = self.X_indices.shape[0]
+        batch_size = min(self.batch_size or n, n)
+        if batch_size == n:
+            # Full batch: order doesn't matter
+            yield self.X_indices, self.y
+            return
+        
+        if not self.shuffle:
+            # Contiguous row ranges are views, no copy at all
+            for start in range(0, n, batch_size):
+                yield self.X_indices[start:start + batch_size], self.y[start:start + batch_size]
+            return
+        
+        # Shuffled: one permutation buffer, reshuffled in place every epoch, and
+        # batches gathered into preallocated arrays instead of fresh fancy-index copies
+        if self._perm is None or self._perm.shape[0] != n:
+            self._perm = np.arange(n)
+        if self._X_batch is None or self._X_batch.shape[0] != batch_size:
+            self._X_batch = np.empty((batch_size, self.X_indices.shape[1]), dtype=self.X_indices.dtype)
+            self._y_batch = np.empty(batch_size, dtype=self.y.dtype)
+        self.rng.shuffle(self._perm)
+        
+        for start in range(0, n, batch_size):
+            idx = self._perm[start:start + batch_size]
+            k = idx.shape[0]
+            X_batch, y_batch = self._X_batch[:k], self._y_batch[:k]
+            np.take(self.X_indices, idx, axis=0, out=X_batch)
+            np.take(self.y, idx, out=y_batch)
+            yield X_batch, y_batch
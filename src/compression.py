@@ -0,0 +1,166 @@
+import numpy as np
+
+# Lossy codecs for weight deltas (local W minus the global W the round started from).
+# Each codec turns a delta into a list of flat arrays ("sections") that
+# src/wire_format.py stores as-is:
+#   none      : [delta]                            lossless, for comparison
+#   int8      : [row_scales f4, q i1]              symmetric per-row quantization
+#   topk      : [index_gaps, values]               the k largest-magnitude entries
+#   topk+int8 : [index_gaps, group_scales f4, q i1] top-k, then int8 in groups
+# Top-k indices are sorted and sent as gaps (the first one absolute), as uint16
+# when every gap fits and uint32 otherwise. Kept values are too sparse for
+# per-row scales to pay off, so topk+int8 uses one scale per TOPK_GROUP values.
+CODECS = {
+    "none": 0,
+    "int8": 1,
+    "topk": 2,
+    "topk+int8": 3,
+}
+CODEC_NAMES = {code: name for name, code in CODECS.items()}
+
+TOPK_GROUP = 128
+_INT8_MAX = 127
+
+
+class CompressionError(ValueError):
+    pass
+
+
+def codec_id(codec):
+    if codec not in CODECS:
+        raise CompressionError(f"Unknown codec {codec!r}, expected one of {sorted(CODECS)}")
+    return CODECS[codec]
+
+
+def _quantize(values, max_abs):
+    """Symmetric int8 quantization; max_abs broadcasts against values"""
+    scales = (max_abs / _INT8_MAX).astype(np.float32)
+    # All-zero rows/groups keep scale 0; divide them by 1 instead so they quantize to 0
+    q = np.rint(values / np.where(scales > 0, scales, 1.0))
+    np.clip(q, -_INT8_MAX, _INT8_MAX, out=q)
+    return scales, q.astype(np.int8)
+
+
+def _quantize_groups(values):
+    padded = np.zeros(-(-values.size // TOPK_GROUP) * TOPK_GROUP, dtype=values.dtype)
+    padded[:values.size] = values
+    groups = padded.reshape(-1, TOPK_GROUP)
+    scales, q = _quantize(groups, np.abs(groups).max(axis=1, keepdims=True))
+    return scales.reshape(-1), q.reshape(-1)[:values.size]
+
+
+def _dequantize_groups(scales, q):
+    return q * np.repeat(scales, TOPK_GROUP)[:q.size]
+
+
+def _top_k(flat, ratio):
+    k = max(1, min(flat.size, int(np.ceil(flat.size * ratio))))
+    if k == flat.size:
+        return np.arange(flat.size)
+    indices = np.argpartition(np.abs(flat), flat.size - k)[flat.size - k:]
+    indices.sort()
+    return indices
+
+
+def _index_gaps(indices):
+    gaps = np.diff(indices, prepend=0)
+    return gaps.astype(np.uint16 if gaps.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32)
+
+
+def _indices_from_gaps(gaps, size):
+    indices = np.cumsum(gaps, dtype=np.int64)
+    if indices.size and (indices[-1] >= size or (indices.size > 1 and gaps[1:].min() == 0)):
+        raise CompressionError("Malformed top-k indices")
+    return indices.astype(np.intp)
+
+
+def _encode(delta_W, codec, topk_ratio):
+    # (sections, kept indices or None, what the server will reconstruct for them)
+    codec_id(codec)
+    flat = delta_W.reshape(-1)
+    if codec == "none":
+        return [flat], None, None
+    if codec == "int8":
+        scales, q = _quantize(delta_W, np.abs(delta_W).max(axis=1, keepdims=True))
+        return [scales.reshape(-1), q.reshape(-1)], None, None
+
+    indices = _top_k(flat, topk_ratio)
+    values = flat[indices]
+    if codec == "topk":
+        return [_index_gaps(indices), values], indices, values
+    scales, q = _quantize_groups(values)
+    return [_index_gaps(indices), scales, q], indices, _dequantize_groups(scales, q)
+
+
+def compress(delta_W, codec, topk_ratio=0.01):
+    """Encode a 2-D delta with codec; returns the list of sections"""
+    return _encode(delta_W, codec, topk_ratio)[0]
+
+
+def decompress(sections, codec, shape, dtype=np.float32):
+    """Decoded delta as ("dense", W) or ("sparse", flat_indices, values)"""
+    rows, cols = shape
+    try:
+        if codec == "none":
+            (flat,) = sections
+            return "dense", flat.reshape(rows, cols)
+        if codec == "int8":
+            scales, q = sections
+            W = np.empty((rows, cols), dtype=dtype)
+            np.multiply(q.reshape(rows, cols), scales[:, None], out=W, casting='unsafe')
+            return "dense", W
+        if codec == "topk":
+            gaps, values = sections
+        elif codec == "topk+int8":
+            gaps, scales, q = sections
+            if scales.size != -(-q.size // TOPK_GROUP):
+                raise CompressionError(f"Malformed {codec} delta: {scales.size} scales for {q.size} values")
+            values = _dequantize_groups(scales, q).astype(dtype)
+        else:
+            raise CompressionError(f"Unknown codec {codec!r}")
+    except CompressionError:
+        raise
+    except ValueError as e:
+        # Wrong section count or sizes for the codec
+        raise CompressionError(f"Malformed {codec} delta: {e}")
+
+    if gaps.size != values.size:
+        raise CompressionError(f"Malformed {codec} delta: {gaps.size} indices for {values.size} values")
+    return "sparse", _indices_from_gaps(gaps, rows * cols), values
+
+
+class ErrorFeedback:
+    """Client-side residual for a lossy codec.
+
+    Whatever compression drops from one round's delta is kept and added to the next
+    round's delta, so small but consistent updates still reach the server.
+    """
+    def __init__(self, codec, topk_ratio=0.01, enabled=True):
+        codec_id(codec)
+        self.codec = codec
+        self.topk_ratio = topk_ratio
+        self.enabled = enabled and codec != "none"
+        self.residual = None
+
+    def compress(self, delta_W):
+        """Compress delta_W plus the carried residual. delta_W is modified in place."""
+        if self.enabled:
+            if self.residual is None or self.residual.shape != delta_W.shape:
+                self.residual = np.zeros_like(delta_W)
+            delta_W += self.residual
+
+        sections, indices, sent = _encode(delta_W, self.codec, self.topk_ratio)
+        if self.enabled:
+            # residual = delta - what the server will reconstruct, without a dense decode
+            residual = self.residual
+            if indices is None:
+                scales, q = sections
+                np.multiply(q.reshape(delta_W.shape), scales[:, None], out=residual, casting='unsafe')
+                np.subtract(delta_W, residual, out=residual)
+            else:
+                np.copyto(residual, delta_W)
+                residual.reshape(-1)[indices] -= sent
+        return sections
+
+    def reset(self):
+        self.residual = None
@@ -1,64 +1,184 @@
+import hashlib
+import json
+import os
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 class DataProcessor:
-    def __init__(self, file_path, seq_length=50):
+    def __init__(self, file_path, seq_length=50, stride=3, cache_dir=None):
         self.file_path = file_path
         self.seq_length = seq_length
-        self.text = ""
+        self.stride = stride # Default step between windows (3 reduces data size for demo)
+        # Encoded corpus cache; defaults to a .corpus_cache folder next to the corpus
+        self.cache_dir = cache_dir or os.getenv('CORPUS_CACHE_DIR') or \
+            os.path.join(os.path.dirname(os.path.abspath(file_path)), '.corpus_cache')
+        self.encoded = np.empty(0, dtype=np.uint8)
         self.chars = []
         self.char_to_ix = {}
         self.ix_to_char = {}
         self.vocab_size = 0
+        self.index_dtype = np.uint8
+        self.codepoints = None
+        self.char_lut = None
+        self.char_known = None
         
     def load_data(self):
-        with open(self.file_path, 'r', encoding='utf-8') as f:
-            self.text = f.read()
+        """Loads the corpus as an integer-encoded array.
+
+        The first load of a corpus writes the encoded array and vocab to cache_dir,
+        keyed by the file's SHA-256. Later loads memory-map that cache instead of
+        decoding the text and rebuilding the vocab.
+        """
+        with open(self.file_path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        array_path = os.path.join(self.cache_dir, f"{digest}.npy")
+        vocab_path = os.path.join(self.cache_dir, f"{digest}.vocab.json")
+        
+        if os.path.exists(array_path) and os.path.exists(vocab_path):
+            with open(vocab_path, 'r', encoding='utf-8') as f:
+                self._set_vocab(json.load(f)["chars"])
+            self.encoded = np.load(array_path, mmap_mode='r')
+            source = "cache"
+        else:
+            text = raw.decode('utf-8')
+            del raw
+            self._set_vocab(sorted(list(set(text))))
+            self.encoded = self.encode(text)
+            del text
+            source = "text"
+            try:
+                self._write_cache(array_path, vocab_path)
+                self.encoded = np.load(array_path, mmap_mode='r')
+            except OSError as e:
+                print(f"Could not write corpus cache to {self.cache_dir}: {e}")
         
-        self.chars = sorted(list(set(self.text)))
+        print(f"Data loaded from {source}. Length: {len(self.encoded)} chars. Vocab size: {self.vocab_size}")
+
+    def _set_vocab(self, chars):
+        self.chars = chars
         self.vocab_size = len(self.chars)
         self.char_to_ix = {ch:i for i,ch in enumerate(self.chars)}
         self.ix_to_char = {i:ch for i,ch in enumerate(self.chars)}
-        
-        print(f"Data loaded. Length: {len(self.text)} chars. Vocab size: {self.vocab_size}")
+        self._build_lookup_table()
+
+    def _write_cache(self, array_path, vocab_path):
+        # Write to temp files and rename so concurrent loaders never see partial files
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_array, tmp_vocab = array_path + ".tmp", vocab_path + ".tmp"
+        with open(tmp_array, 'wb') as f:
+            np.save(f, self.encoded)
+        with open(tmp_vocab, 'w', encoding='utf-8') as f:
+            json.dump({"chars": self.chars}, f)
+        os.replace(tmp_array, array_path)
+        os.replace(tmp_vocab, vocab_path)
+
+    def __getstate__(self):
+        # Pickle a memory-mapped corpus as its cache path rather than its contents
+        state = self.__dict__.copy()
+        if isinstance(self.encoded, np.memmap) and self.encoded.filename:
+            state["encoded"] = self.encoded.filename
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self.encoded, str):
+            self.encoded = np.load(self.encoded, mmap_mode='r')
+
+    @property
+    def text(self):
+        """Decoded corpus. Builds the whole string, so prefer slicing self.encoded"""
+        return self.decode(self.encoded)
+
+    def _build_lookup_table(self):
+        """Codepoint -> index table used to encode text without per-character dict lookups"""
+        self.index_dtype = np.uint8 if self.vocab_size <= 256 else np.uint16
+        self.codepoints = np.array([ord(ch) for ch in self.chars], dtype=np.uint32)
+        self.char_lut = np.zeros(int(self.codepoints.max()) + 1 if self.vocab_size else 1, dtype=self.index_dtype)
+        self.char_lut[self.codepoints] = np.arange(self.vocab_size, dtype=self.index_dtype)
+        # Slots of char_lut that hold a real character; the rest are 0 but not valid
+        self.char_known = np.zeros(self.char_lut.size, dtype=bool)
+        self.char_known[self.codepoints] = True
+
+    def encode(self, text):
+        """Convert a string to an array of vocab indices.
 
-    def create_dataset(self, text_chunk):
-        """Creates X, y data for a given text chunk"""
-        inputs = []
-        targets = []
+        Raises KeyError for characters that are not in the vocab.
+        """
+        codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        if codepoints.size:
+            if codepoints.max() < self.char_known.size:
+                known = self.char_known[codepoints]
+            else:
+                known = codepoints < self.char_known.size
+                known[known] = self.char_known[codepoints[known]]
+            if not known.all():
+                unknown = chr(codepoints[np.argmin(known)])
+                raise KeyError(f"Character {unknown!r} is not in the vocabulary")
+        return self.char_lut[codepoints]
+
+    def decode(self, indices):
+        """Convert an array of vocab indices back to a string"""
+        return self.codepoints[np.asarray(indices)].astype('<u4').tobytes().decode('utf-32-le')
+
+    def _windows(self, data, stride, max_samples):
+        """Strided (num_samples, seq_length) window view over encoded data plus targets"""
+        encoded = self.encode(data) if isinstance(data, str) else np.asarray(data)
+        stride = stride or self.stride
         
-        for i in range(0, len(text_chunk) - self.seq_length, 3): # Step 3 to reduce data size for demo
-            inputs.append([self.char_to_ix[ch] for ch in text_chunk[i:i+self.seq_length]])
-            targets.append(self.char_to_ix[text_chunk[i+self.seq_length]])
-            
-        return np.array(inputs), np.array(targets)
+        num_samples = max(0, -(-(len(encoded) - self.seq_length) // stride))
+        if max_samples is not None:
+            num_samples = min(num_samples, max_samples)
+        if num_samples == 0:
+            return np.empty((0, self.seq_length), dtype=encoded.dtype), np.empty(0, dtype=encoded.dtype)
+        
+        # Windows overlap, so this is a read-only view that shares memory with encoded
+        inputs = sliding_window_view(encoded, self.seq_length)[:num_samples * stride:stride]
+        targets = encoded[self.seq_length::stride][:num_samples]
+        return inputs, targets
+
+    def create_dataset(self, data, stride=None, max_samples=None):
+        """Creates X, y data for a given text chunk or encoded array.
+
+        X is a (num_samples, seq_length) index array and y the index of the character
+        following each window. Windows start every `stride` characters.
+        """
+        return self._windows(data, stride, max_samples)
+
+    def iter_dataset(self, data, batch_size, stride=None, max_samples=None):
+        """Generator version of create_dataset yielding (X, y) batches of batch_size samples"""
+        inputs, targets = self._windows(data, stride, max_samples)
+        for start in range(0, len(inputs), batch_size):
+            yield inputs[start:start + batch_size], targets[start:start + batch_size]
     
     def indices_to_text(self, indices):
         """Convert list of indices back to string"""
         return "".join([self.ix_to_char[i] for i in indices])
 
     def one_hot_encode(self, inputs):
-        """Flattened one-hot encoding for Logistic Regression"""
+        """Flattened one-hot encoding for Logistic Regression.
+
+        Only needed for the dense path: the model and clients work directly on the
+        (batch_size, seq_length) index arrays returned by create_dataset.
+        """
         # inputs shape: (batch_size, seq_length)
         # output shape: (batch_size, seq_length * vocab_size)
         batch_size = inputs.shape[0]
         one_hot = np.zeros((batch_size, self.seq_length * self.vocab_size))
-        
-        for i in range(batch_size):
-            for t in range(self.seq_length):
-                char_idx = inputs[i, t]
-                one_hot[i, t * self.vocab_size + char_idx] = 1
+        offsets = np.arange(self.seq_length) * self.vocab_size
+        one_hot[np.arange(batch_size)[:, None], inputs + offsets] = 1
                 
         return one_hot
 
     def partition_data(self, num_clients):
-        """Splits data among clients"""
+        """Splits data among clients as zero-copy views of the encoded corpus"""
         # Just creating simple partitions for simulation
-        chunk_size = len(self.text) // num_clients
+        chunk_size = len(self.encoded) // num_clients
         partitions = []
         
         for i in range(num_clients):
             start = i * chunk_size
             end = start + chunk_size
-            partitions.append(self.text[start:end])
+            partitions.append(self.encoded[start:end])
             
         return partitions
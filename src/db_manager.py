@@ -1,129 +1,427 @@
-import mysql.connector
-from mysql.connector import Error
+import hashlib
 import json
-import os
+import threading
+import time
+from contextlib import contextmanager
+
+from src.metrics import REGISTRY
+from src.storage import Error, backend_from_env
+
+_QUERY_SECONDS = REGISTRY.histogram("fl_db_query_seconds", "DBManager statement latency by query", ["query"])
+_QUERY_ERRORS = REGISTRY.counter("fl_db_query_errors_total", "DBManager statements that raised, by query", ["query"])
+# query name -> (latency child, error child), bound on first use
+_query_metrics = {}
+
+def _metrics_for(query):
+    metrics = _query_metrics.get(query)
+    if metrics is None:
+        metrics = _query_metrics[query] = (_QUERY_SECONDS.labels(query), _QUERY_ERRORS.labels(query))
+    return metrics
 
 class DBManager:
-    def __init__(self, host=None, user=None, password=None, database=None, port=None):
-        self.config = {
-            'host': host or os.getenv('DB_HOST', 'mysql.gb.stackcp.com'),
-            'user': user or os.getenv('DB_USER', 'Nam'),
-            'password': password or os.getenv('DB_PASSWORD', 'S@i85t@run'),
-            'port': port or int(os.getenv('DB_PORT', 41286)),
-            'database': database or os.getenv('DB_NAME', 'nam-project-313937c3b4')
-        }
-        self.database = self.config['database']
+    """The ledger and model store.
+
+    Queries are written once, in MySQL syntax; the storage backend (src/storage.py,
+    chosen by DB_BACKEND) translates them and owns connection pooling. Schema setup
+    runs once per database per process (see init_schema), not on every connect().
+    """
+    _schema_ready = set()
+    _schema_lock = threading.Lock()
+    # Callables fn(table) run after a committed write to a table (e.g. cache invalidation)
+    _write_listeners = []
+
+    def __init__(self, host=None, user=None, password=None, database=None, port=None, backend=None):
+        # Connection settings apply to MySQL; DB_BACKEND=sqlite uses DB_PATH instead
+        self.backend = backend or backend_from_env(
+            host=host, user=user, password=password, database=database, port=port)
         self.conn = None
         self.cursor = None
+        self._transaction_depth = 0
+        self._pending_writes = set()
 
     def connect(self):
         try:
-            # Connect directly to the specific database
-            self.conn = mysql.connector.connect(**self.config)
+            self.conn = self.backend.checkout()
             self.cursor = self.conn.cursor()
+            self.init_schema()
             
-            # self.cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.database}") # Not allowed on shared hosting
-            self.cursor.execute(f"USE `{self.database}`")
+        except Error as e:
+            print(f"Error connecting to {self.backend.name} database: {e}")
+            if self.conn is not None:
+                self.backend.release(self.conn)
+                self.conn = self.cursor = None
+            raise e
+
+    def init_schema(self):
+        """Creates the tables once per process; later calls are no-ops"""
+        key = self.backend.pool_key()
+        if key in DBManager._schema_ready:
+            return
+        with DBManager._schema_lock:
+            if key in DBManager._schema_ready:
+                return
+            self.backend.prepare_schema(self.cursor)
             
             self._create_tables()
+            DBManager._schema_ready.add(key)
             print("Successfully connected to the database and initialized tables.")
-            
-        except Error as e:
-            print(f"Error connecting to MySQL: {e}")
-            raise e
+
+    def _execute(self, sql, params=(), query="other"):
+        """Runs one statement, timed under the query name in the process metrics"""
+        self._timed(query, self.cursor.execute, self.backend.sql(sql), params)
+
+    def _executemany(self, sql, rows, query="other"):
+        self._timed(query, self.cursor.executemany, self.backend.sql(sql), rows)
+
+    @staticmethod
+    def _timed(query, call, *args):
+        seconds, errors = _metrics_for(query)
+        t = time.perf_counter()
+        try:
+            call(*args)
+        except Error:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - t)
+
+    # Versioned schema migrations: (version, description, statements), applied in
+    # order on first connect and recorded in schema_migrations. Never edit a
+    # released migration; append a new one.
+    MIGRATIONS = [
+        (1, "initial schema", [
+            # Table for Registered Clients
+            """
+            CREATE TABLE IF NOT EXISTS clients (
+                client_id VARCHAR(255) PRIMARY KEY,
+                public_key TEXT NOT NULL,
+                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            # Table for FL Rounds
+            """
+            CREATE TABLE IF NOT EXISTS rounds (
+                round_id INT AUTO_INCREMENT PRIMARY KEY,
+                status VARCHAR(50) DEFAULT 'IN_PROGRESS',
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            # Table for Model Updates (The Ledger)
+            # encrypted_update: The actual gradients/weights encrypted
+            # signature: Digital signature of the update
+            """
+            CREATE TABLE IF NOT EXISTS updates (
+                update_id INT AUTO_INCREMENT PRIMARY KEY,
+                round_id INT,
+                client_id VARCHAR(255),
+                encrypted_data LONGTEXT,
+                nonce TEXT,
+                tag TEXT,
+                signature TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (round_id) REFERENCES rounds(round_id),
+                FOREIGN KEY (client_id) REFERENCES clients(client_id)
+            )
+            """,
+            # Table for Global Model Checkpoints
+            """
+            CREATE TABLE IF NOT EXISTS global_models (
+                model_id INT AUTO_INCREMENT PRIMARY KEY,
+                round_id INT,
+                model_data LONGTEXT,
+                accuracy FLOAT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (round_id) REFERENCES rounds(round_id)
+            )
+            """,
+        ]),
+        (2, "ledger indexes", [
+            # Per-round update fetch (aggregation) and time-ordered ledger scans
+            "CREATE INDEX idx_updates_round_client ON updates (round_id, client_id)",
+            "CREATE INDEX idx_updates_timestamp ON updates (timestamp)",
+        ]),
+        (3, "binary model checkpoints", [
+            # Binary checkpoints (src/checkpoint.py); model_data stays for JSON rows.
+            # base_round_id is set when model_blob is a delta against that round.
+            "ALTER TABLE global_models ADD COLUMN model_blob LONGBLOB NULL",
+            "ALTER TABLE global_models ADD COLUMN base_round_id INT NULL",
+            "CREATE INDEX idx_global_models_round ON global_models (round_id)",
+        ]),
+        (4, "ledger listing columns", [
+            # Computed at insert time so ledger listings never read encrypted_data
+            "ALTER TABLE updates ADD COLUMN payload_digest CHAR(64) NULL",
+            "ALTER TABLE updates ADD COLUMN signature_prefix VARCHAR(32) NULL",
+            {
+                "mysql": """
+                UPDATE updates
+                SET payload_digest = SHA2(encrypted_data, 256), signature_prefix = LEFT(signature, 20)
+                WHERE payload_digest IS NULL
+                """,
+                # SQLite has no LEFT(); SHA2() is registered by the backend
+                "sqlite": """
+                UPDATE updates
+                SET payload_digest = SHA2(encrypted_data, 256), signature_prefix = substr(signature, 1, 20)
+                WHERE payload_digest IS NULL
+                """,
+            },
+        ]),
+    ]
 
     def _create_tables(self):
-        # Table for Registered Clients
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS clients (
-            client_id VARCHAR(255) PRIMARY KEY,
-            public_key TEXT NOT NULL,
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-
-        # Table for FL Rounds
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS rounds (
-            round_id INT AUTO_INCREMENT PRIMARY KEY,
-            status VARCHAR(50) DEFAULT 'IN_PROGRESS',
-            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-
-        # Table for Model Updates (The Ledger)
-        # encrypted_update: The actual gradients/weights encrypted
-        # signature: Digital signature of the update
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS updates (
-            update_id INT AUTO_INCREMENT PRIMARY KEY,
-            round_id INT,
-            client_id VARCHAR(255),
-            encrypted_data LONGTEXT,
-            nonce TEXT,
-            tag TEXT,
-            signature TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (round_id) REFERENCES rounds(round_id),
-            FOREIGN KEY (client_id) REFERENCES clients(client_id)
+        """Applies any pending schema migrations"""
+        self._execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        """)
+        """, query="migrate")
+        self._execute("SELECT version FROM schema_migrations", query="migrate")
+        applied = {row[0] for row in self.cursor.fetchall()}
         
-        # Table for Global Model Checkpoints
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS global_models (
-            model_id INT AUTO_INCREMENT PRIMARY KEY,
-            round_id INT,
-            model_data LONGTEXT,
-            accuracy FLOAT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (round_id) REFERENCES rounds(round_id)
-        )
-        """)
-        self.conn.commit()
+        for version, description, statements in self.MIGRATIONS:
+            if version in applied:
+                continue
+            for statement in statements:
+                try:
+                    self._execute(statement, query="migrate")
+                except Error as e:
+                    # Already applied, e.g. by an interrupted earlier run
+                    if not self.backend.is_already_applied(e):
+                        raise
+            self._execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (version, description), query="migrate"
+            )
+            print(f"Applied schema migration {version}: {description}")
+        self._commit()
+
+    def _commit(self):
+        # Connections run in autocommit mode, so only an explicitly opened
+        # transaction needs a COMMIT round trip. Inside round_transaction() the
+        # commit is deferred to the end of the block.
+        if self._transaction_depth == 0 and self.backend.in_transaction(self.conn):
+            self._timed("commit", self.conn.commit)
+
+    @classmethod
+    def add_write_listener(cls, listener):
+        """Registers listener(table), called after each committed write to table"""
+        cls._write_listeners.append(listener)
+
+    def _notify_write(self, *tables):
+        # Inside a transaction, hold notifications until it commits
+        if self._transaction_depth > 0:
+            self._pending_writes.update(tables)
+            return
+        for table in tables:
+            for listener in DBManager._write_listeners:
+                try:
+                    listener(table)
+                except Exception as e:
+                    print(f"Write listener failed for {table}: {e}")
+
+    @contextmanager
+    def round_transaction(self):
+        """Groups a round's writes into a single transaction with one COMMIT.
+
+        Nested blocks join the outer transaction. On an exception the whole block
+        is rolled back.
+        """
+        if self._transaction_depth == 0:
+            self.backend.begin(self.conn)
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self._pending_writes.clear()
+                self.conn.rollback()
+            raise
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self._timed("commit", self.conn.commit)
+            tables, self._pending_writes = self._pending_writes, set()
+            self._notify_write(*tables)
 
     def register_client(self, client_id, public_key_pem):
         try:
             sql = "INSERT IGNORE INTO clients (client_id, public_key) VALUES (%s, %s)"
-            self.cursor.execute(sql, (client_id, public_key_pem))
-            self.conn.commit()
+            self._execute(sql, (client_id, public_key_pem), query="register_client")
+            self._commit()
+            self._notify_write('clients')
         except Error as e:
             print(f"Error registering client: {e}")
 
+    def register_clients_bulk(self, clients):
+        """Registers many (client_id, public_key_pem) pairs with one statement"""
+        clients = list(clients)
+        if not clients:
+            return
+        try:
+            sql = "INSERT IGNORE INTO clients (client_id, public_key) VALUES (%s, %s)"
+            self._executemany(sql, clients, query="register_clients_bulk")
+            self._commit()
+            self._notify_write('clients')
+        except Error as e:
+            print(f"Error registering clients: {e}")
+
     def start_round(self):
         try:
             sql = "INSERT INTO rounds (status) VALUES ('IN_PROGRESS')"
-            self.cursor.execute(sql)
-            self.conn.commit()
+            self._execute(sql, query="start_round")
+            self._commit()
+            self._notify_write('rounds')
             return self.cursor.lastrowid
         except Error as e:
             print(f"Error starting round: {e}")
             return None
 
+    # Ledger listing columns derived from the payload at insert time
+    SIGNATURE_PREFIX_LENGTH = 20
+
+    @staticmethod
+    def payload_digest(encrypted_data):
+        """SHA-256 hex digest of the stored (base64) ciphertext"""
+        return hashlib.sha256(encrypted_data.encode('utf-8')).hexdigest()
+
+    def _update_row(self, round_id, client_id, encrypted_data, nonce, tag, signature):
+        return (round_id, client_id, encrypted_data, nonce, tag, signature,
+                self.payload_digest(encrypted_data), signature[:self.SIGNATURE_PREFIX_LENGTH])
+
+    _INSERT_UPDATE_SQL = """
+    INSERT INTO updates (round_id, client_id, encrypted_data, nonce, tag, signature,
+                         payload_digest, signature_prefix)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """
+
     def store_update(self, round_id, client_id, encrypted_data, nonce, tag, signature):
+        """Stores one update row; returns True on success"""
         try:
-            sql = """
-            INSERT INTO updates (round_id, client_id, encrypted_data, nonce, tag, signature)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            self.cursor.execute(sql, (round_id, client_id, encrypted_data, nonce, tag, signature))
-            self.conn.commit()
+            row = self._update_row(round_id, client_id, encrypted_data, nonce, tag, signature)
+            self._execute(self._INSERT_UPDATE_SQL, row, query="store_update")
+            self._commit()
+            self._notify_write('updates')
+            return True
         except Error as e:
             print(f"Error storing update: {e}")
+            return False
+
+    def store_updates_bulk(self, updates, batch_size=32):
+        """Stores (round_id, client_id, encrypted_data, nonce, tag, signature) rows.
+
+        updates may be any iterable (e.g. a generator over arriving client updates);
+        every batch_size rows go out as one multi-row INSERT via executemany, so
+        only one batch of ciphertexts is buffered at a time. Returns the number of
+        rows stored; a failed batch is skipped as a whole.
+        """
+        stored = 0
+        batch = []
+        for row in updates:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                stored += self._insert_updates(batch)
+                batch = []
+        if batch:
+            stored += self._insert_updates(batch)
+        return stored
+
+    def _insert_updates(self, rows):
+        try:
+            self.insert_updates(rows)
+            return len(rows)
+        except Error as e:
+            print(f"Error storing updates: {e}")
+            return 0
+
+    def insert_updates(self, rows):
+        """Stores update rows with one multi-row INSERT, raising on failure.
+
+        For callers that retry: backend.is_rejected_row(error) tells rows the ledger
+        refuses (unknown client or round) from transient errors worth retrying.
+        """
+        rows = [self._update_row(*row) for row in rows]
+        self._executemany(self._INSERT_UPDATE_SQL, rows, query="store_updates_bulk")
+        self._commit()
+        self._notify_write('updates')
+
+    def get_update_refs(self, client_id):
+        """(whether client_id is registered, newest round_id or None), raising on failure.
+
+        Unlike the lookups above this raises, so a miss can be told from an outage.
+        """
+        self._execute("SELECT COUNT(*) FROM clients WHERE client_id = %s", (client_id,),
+                      query="get_update_refs")
+        known = self.cursor.fetchone()[0] > 0
+        self._execute("SELECT MAX(round_id) FROM rounds", query="get_update_refs")
+        return known, self.cursor.fetchone()[0]
 
     def get_updates_for_round(self, round_id):
         try:
             sql = "SELECT client_id, encrypted_data, nonce, tag, signature FROM updates WHERE round_id = %s"
-            self.cursor.execute(sql, (round_id,))
+            self._execute(sql, (round_id,), query="get_updates_for_round")
             return self.cursor.fetchall()
         except Error as e:
             print(f"Error fetching updates: {e}")
             return []
 
+    def iter_updates_with_keys(self, round_id, batch_size=16):
+        """Streams a round's updates joined with each client's public key.
+
+        Yields (client_id, encrypted_data, nonce, tag, signature, public_key) rows,
+        public_key being None for unknown clients. Rows are read batch_size at a
+        time from an unbuffered cursor, so no other query may run on this
+        connection until the generator is exhausted or closed. A DB error while
+        streaming is raised to the consumer.
+        """
+        cursor = self.conn.cursor()
+        try:
+            sql = """
+            SELECT u.client_id, u.encrypted_data, u.nonce, u.tag, u.signature, c.public_key
+            FROM updates u
+            LEFT JOIN clients c ON c.client_id = u.client_id
+            WHERE u.round_id = %s
+            ORDER BY u.update_id
+            """
+            self._timed("iter_updates_with_keys", cursor.execute, self.backend.sql(sql), (round_id,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        except Error as e:
+            # Raise rather than end early: a partial round must not be aggregated
+            print(f"Error fetching updates: {e}")
+            raise
+        finally:
+            cursor.close()
+
+    def get_ledger_page(self, before_id=None, limit=50):
+        """One page of the ledger, newest first, using keyset pagination on update_id.
+
+        Returns (update_id, round_id, client_id, payload_digest, signature_prefix,
+        timestamp) rows with update_id < before_id. Never touches the payload columns.
+        """
+        try:
+            sql = """
+            SELECT update_id, round_id, client_id, payload_digest, signature_prefix, timestamp
+            FROM updates
+            """
+            params = ()
+            if before_id is not None:
+                sql += " WHERE update_id < %s"
+                params = (before_id,)
+            sql += " ORDER BY update_id DESC LIMIT %s"
+            self._execute(sql, params + (limit,), query="get_ledger_page")
+            return self.cursor.fetchall()
+        except Error as e:
+            print(f"Error fetching ledger: {e}")
+            return []
+
     def get_client_public_key(self, client_id):
         try:
             sql = "SELECT public_key FROM clients WHERE client_id = %s"
-            self.cursor.execute(sql, (client_id,))
+            self._execute(sql, (client_id,), query="get_client_public_key")
             result = self.cursor.fetchone()
             if result:
                 return result[0]
@@ -132,14 +430,66 @@ class DBManager:
             print(f"Error fetching public key: {e}")
             return None
 
-    def store_global_model(self, round_id, model_data_json, accuracy):
+    def get_client_public_keys(self, client_ids):
+        """Public keys for many clients in one query, as {client_id: pem}"""
+        client_ids = list(client_ids)
+        if not client_ids:
+            return {}
         try:
-            sql = "INSERT INTO global_models (round_id, model_data, accuracy) VALUES (%s, %s, %s)"
-            self.cursor.execute(sql, (round_id, model_data_json, accuracy))
-            self.conn.commit()
+            placeholders = ", ".join(["%s"] * len(client_ids))
+            sql = f"SELECT client_id, public_key FROM clients WHERE client_id IN ({placeholders})"
+            self._execute(sql, tuple(client_ids), query="get_client_public_keys")
+            return dict(self.cursor.fetchall())
+        except Error as e:
+            print(f"Error fetching public keys: {e}")
+            return {}
+
+    def store_global_model(self, round_id, model_data, accuracy, base_round_id=None):
+        """Stores a checkpoint: bytes go to model_blob (binary format), str to model_data (JSON)"""
+        try:
+            if isinstance(model_data, (bytes, bytearray)):
+                sql = """
+                INSERT INTO global_models (round_id, model_blob, base_round_id, accuracy)
+                VALUES (%s, %s, %s, %s)
+                """
+                self._execute(sql, (round_id, bytes(model_data), base_round_id, accuracy),
+                              query="store_global_model")
+            else:
+                sql = "INSERT INTO global_models (round_id, model_data, accuracy) VALUES (%s, %s, %s)"
+                self._execute(sql, (round_id, model_data, accuracy), query="store_global_model")
+            self._commit()
+            self._notify_write('global_models')
         except Error as e:
             print(f"Error storing global model: {e}")
 
+    def get_checkpoint_chain(self, round_id=None):
+        """Checkpoint rows needed to rebuild a round's model (latest round if None).
+
+        Returns [(round_id, model_data, model_blob), ...] from the full checkpoint to
+        the requested round by following base_round_id links, or [] if not found.
+        """
+        chain = []
+        try:
+            if round_id is None:
+                self._execute("SELECT MAX(round_id) FROM global_models", query="get_checkpoint_chain")
+                round_id = self.cursor.fetchone()[0]
+            while round_id is not None:
+                sql = """
+                SELECT round_id, model_data, model_blob, base_round_id FROM global_models
+                WHERE round_id = %s ORDER BY model_id DESC LIMIT 1
+                """
+                self._execute(sql, (round_id,), query="get_checkpoint_chain")
+                row = self.cursor.fetchone()
+                if row is None:
+                    return []
+                chain.append(row[:3])
+                round_id = row[3]
+            chain.reverse()
+            return chain
+        except Error as e:
+            print(f"Error fetching checkpoint: {e}")
+            return []
+
     def get_global_models(self):
         try:
             sql = """
@@ -148,7 +498,7 @@ class DBManager:
             JOIN rounds r ON m.round_id = r.round_id 
             ORDER BY m.round_id DESC
             """
-            self.cursor.execute(sql)
+            self._execute(sql, query="get_global_models")
             return self.cursor.fetchall()
         except Error as e:
             print(f"Error fetching global models: {e}")
@@ -158,7 +508,7 @@ class DBManager:
     def get_all_clients(self):
         try:
             sql = "SELECT client_id, registered_at FROM clients ORDER BY registered_at DESC"
-            self.cursor.execute(sql)
+            self._execute(sql, query="get_all_clients")
             return self.cursor.fetchall()
         except Error as e:
             print(f"Error fetching clients: {e}")
@@ -167,7 +517,7 @@ class DBManager:
     def get_model_history(self):
         try:
             sql = "SELECT model_id, round_id, accuracy, created_at FROM global_models ORDER BY model_id DESC LIMIT 20"
-            self.cursor.execute(sql)
+            self._execute(sql, query="get_model_history")
             return self.cursor.fetchall()
         except Error as e:
             print(f"Error fetching model history: {e}")
@@ -175,20 +525,22 @@ class DBManager:
 
     def reset_database(self):
         try:
-            # Disable FK checks to truncate tables freely
-            self.cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
-            self.cursor.execute("TRUNCATE TABLE updates")
-            self.cursor.execute("TRUNCATE TABLE rounds")
-            self.cursor.execute("TRUNCATE TABLE global_models")
-            self.cursor.execute("TRUNCATE TABLE clients")
-            self.cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
-            self.conn.commit()
+            for statement in self.backend.reset_statements():
+                self._execute(statement, query="reset_database")
+            self._commit()
+            self._notify_write('updates', 'rounds', 'global_models', 'clients')
             return True
         except Error as e:
             print(f"Error resetting database: {e}")
             return False
 
     def close(self):
-        if self.conn and self.conn.is_connected():
-            self.cursor.close()
-            self.conn.close()
+        """Returns the connection to the pool"""
+        if self.conn:
+            try:
+                self.cursor.close()
+            except Error:
+                pass
+            self.backend.release(self.conn)
+            self.conn = None
+            self.cursor = None
@@ -1,9 +1,12 @@
 import numpy as np
 
 class LogisticRegressionModel:
-    def __init__(self, vocab_size, seq_length):
+    def __init__(self, vocab_size, seq_length, dtype=np.float32):
         self.vocab_size = vocab_size
         self.seq_length = seq_length
+        # Parameter and compute dtype. float32 halves memory, bandwidth and update
+        # size; float64 reproduces the original numerics.
+        self.dtype = np.dtype(dtype)
         # Initialize weights and bias
         # Input features: One-hot encoded characters flattened = seq_length * vocab_size
         # Output classes: vocab_size (next character prediction)
@@ -11,45 +14,219 @@ class LogisticRegressionModel:
         self.output_dim = vocab_size
         
         # Initialize weights with small random values
-        self.W = np.random.randn(self.input_dim, self.output_dim) * 0.01
-        self.b = np.zeros(self.output_dim)
+        self.W = (np.random.randn(self.input_dim, self.output_dim) * 0.01).astype(self.dtype)
+        self.b = np.zeros(self.output_dim, dtype=self.dtype)
+        
+        # Scratch buffers for the index-input kernels, grown to the largest batch seen
+        self._ws = None
+
+    def __getstate__(self):
+        # Workspaces are rebuilt on demand; don't ship them to worker processes
+        state = self.__dict__.copy()
+        state["_ws"] = None
+        return state
+
+    def softmax(self, z, out=None):
+        """Row-wise softmax. With out=z (or another buffer) it runs without temporaries."""
+        if out is None:
+            exp_z = np.exp(z - np.max(z, axis=1, keepdims=True)) # numeric stability
+            return exp_z / np.sum(exp_z, axis=1, keepdims=True)
+        for start in range(0, z.shape[0], self.WORKSPACE_ROWS):
+            stop = min(start + self.WORKSPACE_ROWS, z.shape[0])
+            self._softmax_rows(z[start:stop], out[start:stop])
+        return out
 
-    def softmax(self, z):
-        exp_z = np.exp(z - np.max(z, axis=1, keepdims=True)) # numeric stability
-        return exp_z / np.sum(exp_z, axis=1, keepdims=True)
+    def _softmax_rows(self, z, out):
+        m = z.shape[0]
+        row = self._workspace(m)["row"][:m]
+        np.max(z, axis=1, out=row)
+        np.subtract(z, row[:, None], out=out)
+        np.exp(out, out=out)
+        np.sum(out, axis=1, out=row)
+        out /= row[:, None]
+
+    def is_index_input(self, X):
+        """Index inputs are (batch_size, seq_length) integer arrays of character ids.
+
+        An integer one-hot matrix is (batch_size, seq_length * vocab_size), so the
+        width tells the two apart (they coincide only for a 1-character vocab).
+        """
+        return (X.ndim == 2 and np.issubdtype(X.dtype, np.integer)
+                and X.shape[1] == self.seq_length and self.vocab_size > 1)
 
     def forward(self, X):
-        # X shape: (batch_size, input_dim)
+        # X shape: (batch_size, input_dim) one-hot, or (batch_size, seq_length) indices
+        if self.is_index_input(X):
+            return self.forward_indices(X)
         z = np.dot(X, self.W) + self.b
         return self.softmax(z)
 
     def compute_loss(self, X, y_true_indices):
         """Cross Entropy Loss"""
+        if self.is_index_input(X):
+            return self.compute_loss_indices(X, y_true_indices)
         y_pred = self.forward(X)
-        m = X.shape[0]
-        # Get probabilities for the correct classes
-        log_likelihood = -np.log(y_pred[range(m), y_true_indices] + 1e-9)
-        loss = np.sum(log_likelihood) / m
-        return loss
+        return self._cross_entropy(y_pred, y_true_indices)
 
     def compute_gradients(self, X, y_true_indices):
+        if self.is_index_input(X):
+            return self.compute_gradients_indices(X, y_true_indices)
         m = X.shape[0]
-        y_pred = self.forward(X)
-        
-        # Create one-hot for true labels to compute gradient
-        y_true_onehot = np.zeros_like(y_pred)
-        y_true_onehot[range(m), y_true_indices] = 1
-        
-        # Gradient of Softmax + Cross Entropy is (pred - true)
-        dz = y_pred - y_true_onehot
+        dz = self._output_error(self.forward(X), y_true_indices)
         
         dW = np.dot(X.T, dz) / m
         db = np.sum(dz, axis=0) / m
         
         return dW, db
 
+    # --- Index-input kernels ---
+    # Row t * vocab_size + c of W holds the weights for character c at position t,
+    # so a one-hot product X @ W is just a sum of seq_length gathered rows.
+    # Batches are processed WORKSPACE_ROWS rows at a time, so the scratch buffers
+    # stay a few MB however large the (full) batch is.
+
+    WORKSPACE_ROWS = 4096
+
+    def _workspace(self, m):
+        """Scratch buffers for chunks of up to m (<= WORKSPACE_ROWS) rows, reallocated only when outgrown"""
+        ws = self._ws
+        m = min(m, self.WORKSPACE_ROWS)
+        if ws is None or ws["capacity"] < m or ws["dtype"] != self.W.dtype or ws["dW"].shape != self.W.shape:
+            capacity = max(m, ws["capacity"] if ws is not None else 0)
+            ws = self._ws = {
+                "capacity": capacity,
+                "dtype": self.W.dtype,
+                "X_T": np.empty((self.seq_length, capacity), dtype=np.intp),
+                "z": np.empty((capacity, self.output_dim), dtype=self.W.dtype),
+                "gather": np.empty((capacity, self.output_dim), dtype=self.W.dtype),
+                "row": np.empty(capacity, dtype=self.W.dtype),
+                "rows_idx": np.empty(capacity, dtype=np.intp),
+                # bincount works in float64; keeping dz there avoids a cast per call
+                "dz": np.empty((capacity, self.output_dim), dtype=np.float64),
+                # Flat (character, class) bin of every dz entry, for one bincount per position
+                "bins": np.empty((capacity, self.output_dim), dtype=np.intp),
+                "classes": np.arange(self.output_dim, dtype=np.intp),
+                "dW": np.empty_like(self.W),
+                "db": np.empty_like(self.b),
+                "step_W": np.empty_like(self.W),
+            }
+        return ws
+
+    def _chunks(self, m):
+        for start in range(0, m, self.WORKSPACE_ROWS):
+            yield start, min(start + self.WORKSPACE_ROWS, m)
+
+    def _positions_major(self, X_idx):
+        # (seq_length, chunk_size) copy so each position is a contiguous row
+        m = X_idx.shape[0]
+        X_T = self._workspace(m)["X_T"][:, :m]
+        np.copyto(X_T, X_idx.T, casting='unsafe')
+        # The kernels below index without bounds checks, so check the ids once here
+        if m and (X_T.min() < 0 or X_T.max() >= self.vocab_size):
+            raise ValueError(f"Character ids must be in [0, {self.vocab_size}), "
+                             f"got [{X_T.min()}, {X_T.max()}]")
+        return X_T
+
+    def _logits_indices(self, X_T, out):
+        """z = X @ W + b for one chunk of index inputs (from _positions_major), written into out"""
+        m = X_T.shape[1]
+        ws = self._workspace(m)
+        rows_idx, gathered = ws["rows_idx"][:m], ws["gather"][:m]
+        out[:] = self.b
+        for t in range(self.seq_length):
+            np.add(X_T[t], t * self.vocab_size, out=rows_idx)
+            # Ids were range-checked in _positions_major; mode='clip' lets take()
+            # write straight into the buffer instead of staging a copy
+            np.take(self.W, rows_idx, axis=0, out=gathered, mode='clip')
+            out += gathered
+        return out
+
+    def forward_indices(self, X_idx):
+        """Forward pass for index inputs: gather-and-sum of seq_length rows of W"""
+        z = np.empty((X_idx.shape[0], self.output_dim), dtype=self.W.dtype)
+        for start, stop in self._chunks(X_idx.shape[0]):
+            self._logits_indices(self._positions_major(X_idx[start:stop]), z[start:stop])
+            self._softmax_rows(z[start:stop], z[start:stop])
+        return z
+
+    def _probs_indices(self, X_T):
+        # Like forward_indices for one chunk, but into the workspace; valid until the next call
+        m = X_T.shape[1]
+        z = self._workspace(m)["z"][:m]
+        self._logits_indices(X_T, z)
+        self._softmax_rows(z, z)
+        return z
+
+    def compute_loss_indices(self, X_idx, y_true_indices):
+        """Cross Entropy Loss for index inputs"""
+        m = X_idx.shape[0]
+        if m == 0:
+            # Like the dense path, whose mean over no samples is nan
+            return np.nan
+        y_true_indices = np.asarray(y_true_indices)
+        total = 0.0
+        for start, stop in self._chunks(m):
+            probs = self._probs_indices(self._positions_major(X_idx[start:stop]))
+            total += self._cross_entropy(probs, y_true_indices[start:stop]) * (stop - start)
+        return total / m
+
+    def compute_gradients_indices(self, X_idx, y_true_indices):
+        """Gradients for index inputs: scatter-add of dz into the gathered rows of W.
+
+        The returned dW and db live in the model's workspace and are overwritten
+        by the next call; apply (or copy) them before computing the next batch.
+        """
+        m = X_idx.shape[0]
+        y_true_indices = np.asarray(y_true_indices)
+        ws = self._workspace(m)
+        dW, db = ws["dW"], ws["db"]
+        dW.fill(0)
+        db.fill(0)
+        bins_per_position = self.vocab_size * self.output_dim
+        for start, stop in self._chunks(m):
+            c = stop - start
+            # Positions-major ids, shared by the gather (logits) and the scatter below
+            X_T = self._positions_major(X_idx[start:stop])
+            probs = self._probs_indices(X_T)
+            dz = ws["dz"][:c]
+            np.copyto(dz, self._output_error(probs, y_true_indices[start:stop]))
+            dz /= m
+            db += dz.sum(axis=0)
+            
+            # Scatter-add per position block: one weighted bincount over the flat
+            # (character, class) bins of the chunk (much faster than np.add.at)
+            bins = ws["bins"][:c]
+            for t in range(self.seq_length):
+                np.multiply(X_T[t][:, None], self.output_dim, out=bins)
+                bins += ws["classes"]
+                block = dW[t * self.vocab_size:(t + 1) * self.vocab_size]
+                block += np.bincount(bins.reshape(-1), weights=dz.reshape(-1),
+                                     minlength=bins_per_position).reshape(self.vocab_size, self.output_dim)
+
+        return dW, db
+
+    def _cross_entropy(self, y_pred, y_true_indices):
+        m = y_pred.shape[0]
+        # Get probabilities for the correct classes
+        log_likelihood = -np.log(y_pred[range(m), y_true_indices] + 1e-9)
+        loss = np.sum(log_likelihood) / m
+        return loss
+
+    def _output_error(self, y_pred, y_true_indices):
+        # Gradient of Softmax + Cross Entropy is (pred - true)
+        m = y_pred.shape[0]
+        dz = y_pred
+        dz[range(m), y_true_indices] -= 1
+        return dz
+
     def update_parameters(self, dW, db, learning_rate=0.1):
-        self.W -= learning_rate * dW
+        # W -= lr * dW through a scratch buffer instead of a fresh temporary
+        step_W = self._workspace(0)["step_W"]
+        if step_W.shape == dW.shape:
+            np.multiply(dW, learning_rate, out=step_W, casting='unsafe')
+            self.W -= step_W
+        else:
+            self.W -= learning_rate * dW
         self.b -= learning_rate * db
 
     def get_parameters(self):
@@ -59,6 +236,30 @@ class LogisticRegressionModel:
         self.W = W
         self.b = b
 
+    def to_checkpoint(self, round_id=0, dtype=None, compress=True):
+        """Full binary checkpoint (see src/checkpoint.py)"""
+        from src.checkpoint import encode_checkpoint
+        return encode_checkpoint(self.W, self.b, round_id, dtype=dtype, compress=compress)
+
+    @staticmethod
+    def from_checkpoint(blob, base=None):
+        """Rebuild a model from a checkpoint blob (base=(W, b) for delta checkpoints)"""
+        from src.checkpoint import decode_checkpoint
+        _, W, b = decode_checkpoint(blob, base=base)
+        return LogisticRegressionModel.from_parameters(np.array(W), np.array(b))
+
+    @staticmethod
+    def from_parameters(W, b):
+        """Model with the given parameters; dimensions are derived from W"""
+        model = LogisticRegressionModel(1, 1, dtype=W.dtype) # dummy init
+        model.W = W
+        model.b = b
+        model.input_dim = model.W.shape[0]
+        model.output_dim = model.W.shape[1]
+        model.vocab_size = model.output_dim
+        model.seq_length = model.input_dim // model.output_dim
+        return model
+
     def to_json(self):
         import json
         return json.dumps({
@@ -70,11 +271,4 @@ class LogisticRegressionModel:
     def from_json(json_str):
         import json
         data = json.loads(json_str)
-        model = LogisticRegressionModel(1, 1) # dummy init
-        model.W = np.array(data["W"])
-        model.b = np.array(data["b"])
-        model.input_dim = model.W.shape[0]
-        model.output_dim = model.W.shape[1]
-        model.vocab_size = model.output_dim
-        # simplistic reconstruction of dims
-        return model
+        return LogisticRegressionModel.from_parameters(np.array(data["W"]), np.array(data["b"]))
@@ -0,0 +1,153 @@
+import multiprocessing as mp
+import os
+import queue
+import numpy as np
+from multiprocessing import shared_memory
+from src.client import record_round_stats
+
+class SequentialClientTrainer:
+    """Trains clients one after another in the calling process"""
+    def __init__(self, clients):
+        self.clients = clients
+        self.num_workers = 1
+
+    def train_round(self, global_W, global_b, round_id):
+        for client in self.clients:
+            yield client.train_round(global_W, global_b, round_id)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParallelClientTrainer:
+    """Trains the clients of a round across a pool of worker processes.
+
+    Each worker owns a fixed subset of the clients for the lifetime of the pool, so
+    client state (keys, data, local model) is pickled once at start-up. Each round
+    the global weights are written once into a shared-memory block that every worker
+    reads, and update packages are yielded in the order they finish. Results are
+    tagged with their round_id, so ones a previous round left unread are discarded.
+    """
+    def __init__(self, clients, num_workers=None, result_timeout=5):
+        self.clients = clients
+        self.num_workers = max(1, min(num_workers or os.cpu_count() or 1, len(clients)))
+        self.result_timeout = result_timeout
+        
+        # spawn: safe to start from threads (e.g. inside the Flask app) and on Windows
+        ctx = mp.get_context("spawn")
+        self._result_queue = ctx.Queue()
+        self._task_queues = []
+        self._workers = []
+        for w in range(self.num_workers):
+            task_queue = ctx.Queue()
+            owned = clients[w::self.num_workers]
+            proc = ctx.Process(target=_worker_main, args=(owned, task_queue, self._result_queue), daemon=True)
+            proc.start()
+            self._task_queues.append(task_queue)
+            self._workers.append(proc)
+        self._shm = None
+
+    def _broadcast(self, global_W, global_b):
+        """Copy the global parameters into shared memory; returns the task message"""
+        W = np.ascontiguousarray(global_W)
+        b = np.ascontiguousarray(global_b, dtype=W.dtype)
+        size = W.nbytes + b.nbytes
+        if self._shm is None or self._shm.size < size:
+            self._release_shm()
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        np.ndarray(W.shape, W.dtype, buffer=self._shm.buf)[:] = W
+        np.ndarray(b.shape, W.dtype, buffer=self._shm.buf, offset=W.nbytes)[:] = b
+        return (self._shm.name, W.shape, b.shape, W.dtype.str)
+
+    def train_round(self, global_W, global_b, round_id):
+        """Yields each client's update package as soon as it is ready"""
+        message = self._broadcast(global_W, global_b) + (round_id,)
+        for task_queue in self._task_queues:
+            task_queue.put(message)
+        
+        errors = []
+        for _ in range(len(self.clients)):
+            result = self._next_result(round_id)
+            if "error" in result:
+                errors.append(f"{result['client_id']}: {result['error']}")
+                continue
+            # Workers' metrics die with them; record the stage timings here instead
+            record_round_stats(result.pop("stats"))
+            yield result
+        if errors:
+            raise RuntimeError("Client training failed in worker: " + "; ".join(errors))
+
+    def _next_result(self, round_id):
+        while True:
+            try:
+                result_round_id, result = self._result_queue.get(timeout=self.result_timeout)
+            except queue.Empty:
+                dead = [p.pid for p in self._workers if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Training worker(s) {dead} exited unexpectedly")
+                continue
+            # Left over from a round whose caller stopped reading (an abandoned generator)
+            if result_round_id != round_id:
+                continue
+            return result
+
+    def _release_shm(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def close(self):
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for proc in self._workers:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        self._release_shm()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def make_client_trainer(clients, num_workers=1):
+    """Parallel trainer for num_workers > 1 (None = one per core), else sequential"""
+    if num_workers is not None and num_workers <= 1:
+        return SequentialClientTrainer(clients)
+    return ParallelClientTrainer(clients, num_workers)
+
+
+def _worker_main(clients, task_queue, result_queue):
+    shm = None
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        shm_name, W_shape, b_shape, dtype, round_id = task
+        if shm is None or shm.name != shm_name:
+            if shm is not None:
+                shm.close()
+            # Workers share the parent's resource tracker, and the parent unlinks the block
+            shm = shared_memory.SharedMemory(name=shm_name)
+        
+        W = np.ndarray(W_shape, dtype, buffer=shm.buf)
+        b = np.ndarray(b_shape, dtype, buffer=shm.buf, offset=W.nbytes)
+        for client in clients:
+            try:
+                package = client.train_round(W, b, round_id)
+                package["stats"] = client.last_round_stats
+                result_queue.put((round_id, package))
+            except Exception as e:
+                result_queue.put((round_id, {"client_id": client.client_id, "error": repr(e)}))
+        del W, b
+    if shm is not None:
+        shm.close()
@@ -1,4 +1,6 @@
 import os
+import threading
+from collections import OrderedDict
 from cryptography.hazmat.primitives.asymmetric import rsa, ec
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
@@ -30,12 +32,77 @@ class KeyManager:
     def load_public_key(pem_string):
         return serialization.load_pem_public_key(pem_string.encode('utf-8'))
 
+    @staticmethod
+    def serialize_private_key(private_key):
+        """Unencrypted PKCS8 PEM; only used to hand a client to a local worker process"""
+        return private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+
+    @staticmethod
+    def load_private_key(pem_bytes):
+        return serialization.load_pem_private_key(pem_bytes, password=None)
+
     @staticmethod
     def generate_shared_key():
         """Generates a symmetric key for the session/round (AES-GCM)"""
         return AESGCM.generate_key(bit_length=SecurityParams.AES_KEY_SIZE * 8)
 
 
+class ClientKeyRegistry:
+    """Parsed client public keys, bulk-loaded from the DB and kept in an LRU cache.
+
+    load() fetches the PEMs for a whole round with one query and only re-parses a
+    key when its PEM differs from the cached one. Call invalidate() when a client
+    (re-)registers.
+    """
+    def __init__(self, db_manager, max_size=1024):
+        self.db_manager = db_manager
+        self.max_size = max_size
+        self._cache = OrderedDict() # client_id -> (pem, public_key)
+        self._lock = threading.Lock()
+
+    def load(self, client_ids):
+        """Returns {client_id: public_key} for the known clients among client_ids"""
+        pems = self.db_manager.get_client_public_keys(set(client_ids))
+        return {client_id: self.get(client_id, pem) for client_id, pem in pems.items()}
+
+    def get(self, client_id, pem):
+        """Parsed key for this PEM, from cache when unchanged"""
+        with self._lock:
+            cached = self._cache.get(client_id)
+            if cached and cached[0] == pem:
+                self._cache.move_to_end(client_id)
+                return cached[1]
+        
+        public_key = KeyManager.load_public_key(pem)
+        with self._lock:
+            self._cache[client_id] = (pem, public_key)
+            self._cache.move_to_end(client_id)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return public_key
+
+    def lookup(self, client_id):
+        """Parsed key for one client, from cache or else from the DB; None if unknown"""
+        with self._lock:
+            cached = self._cache.get(client_id)
+            if cached:
+                self._cache.move_to_end(client_id)
+                return cached[1]
+        return self.load([client_id]).get(client_id)
+
+    def invalidate(self, client_id=None):
+        """Drop one client's cached key, or all of them"""
+        with self._lock:
+            if client_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(client_id, None)
+
+
 class CryptoModule:
     @staticmethod
     def sign_data(private_key, data):
@@ -98,8 +165,8 @@ class CryptoModule:
         )
 
     @staticmethod
-    def decrypt_update(key, ciphertext_b64, nonce_b64, tag_b64):
-        """Decrypt data using AES-GCM"""
+    def decrypt_update(key, ciphertext_b64, nonce_b64, tag_b64, as_text=True):
+        """Decrypt data using AES-GCM. Returns str, or raw bytes when as_text is False"""
         # Reconstruct the format AESGCM expects (ciphertext + tag)
         ciphertext = base64.b64decode(ciphertext_b64)
         tag = base64.b64decode(tag_b64)
@@ -109,4 +176,4 @@ class CryptoModule:
         
         aesgcm = AESGCM(key)
         plaintext = aesgcm.decrypt(nonce, full_ciphertext, None)
-        return plaintext.decode('utf-8')
+        return plaintext.decode('utf-8') if as_text else plaintext
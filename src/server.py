@@ -1,74 +1,355 @@
 import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from src.security import CryptoModule, KeyManager
+from src.security import CryptoModule, ClientKeyRegistry
 from src.model import LogisticRegressionModel
+from src.aggregation import StreamingFedAvg
+from src.wire_format import is_binary_update, decode_update, WireFormatError, KIND_DELTA
+from src.compression import CODEC_NAMES, decompress
+from src.metrics import REGISTRY
+
+AGGREGATION_STAGES = ("fetch", "decrypt", "verify", "decode", "fold", "total")
+_STAGE_SECONDS = REGISTRY.histogram(
+    "fl_server_aggregation_stage_seconds",
+    "Time per FLServer.aggregate_updates stage; pool stages are summed across threads", ["stage"])
+_STAGE_TIMERS = tuple((stage, _STAGE_SECONDS.labels(stage)) for stage in AGGREGATION_STAGES)
+_UPDATES = REGISTRY.counter("fl_server_updates_total", "Updates read for aggregation, by outcome", ["result"])
+_VALID_UPDATES = _UPDATES.labels("valid")
+_REJECTED_UPDATES = _UPDATES.labels("rejected")
+_ASYNC_UPDATES = REGISTRY.counter(
+    "fl_server_async_updates_total", "Updates received in asynchronous mode, by outcome", ["result"])
+_BUFFERED_UPDATES = _ASYNC_UPDATES.labels("buffered")
+_STALE_UPDATES = _ASYNC_UPDATES.labels("stale")
+_REJECTED_ASYNC_UPDATES = _ASYNC_UPDATES.labels("rejected")
+_STALENESS = REGISTRY.histogram(
+    "fl_server_update_staleness", "Model versions published while a buffered update was trained",
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16)).labels()
+_MERGES = REGISTRY.counter("fl_server_merges_total", "Buffer merges into the global model").labels()
 
 class FLServer:
-    def __init__(self, vocab_size, seq_length, db_manager, shared_key):
+    def __init__(self, vocab_size, seq_length, db_manager, shared_key,
+                 aggregation_threads=4, max_in_flight=None,
+                 dtype=np.float32, buffer_size=None, staleness_exponent=0.5,
+                 max_staleness=10, server_lr=1.0):
         self.db_manager = db_manager
         self.shared_key = shared_key
         
-        # Initialize Global Model
-        self.global_model = LogisticRegressionModel(vocab_size, seq_length)
+        # Aggregation pipeline: decrypt/verify/decode run on a thread pool, with at
+        # most max_in_flight decrypted updates held in memory at once.
+        self.aggregation_threads = aggregation_threads
+        self.max_in_flight = max_in_flight or 2 * aggregation_threads
+        self.last_aggregation_stats = {}
+        
+        # Parsed client public keys, refreshed in bulk once per round
+        self.key_registry = ClientKeyRegistry(db_manager)
+        
+        # Initialize Global Model (clients train in whatever dtype it is sent in)
+        self.global_model = LogisticRegressionModel(vocab_size, seq_length, dtype=dtype)
+        # Bumped on every global model update; clients report the version they trained from
+        self.model_version = 0
+        
+        # Asynchronous (FedBuff-style) mode, fed by receive_update(): verified updates
+        # are buffered in memory and merged into the global model every buffer_size
+        # arrivals, with no round barrier and no ledger read. An update trained from
+        # a model `staleness` versions old is scaled by
+        # 1 / (1 + staleness) ** staleness_exponent; older than max_staleness, dropped.
+        if buffer_size is not None and buffer_size < 1:
+            raise ValueError(f"buffer_size must be at least 1, got {buffer_size}")
+        self.buffer_size = buffer_size
+        self.staleness_exponent = staleness_exponent
+        self.max_staleness = max_staleness
+        self.server_lr = server_lr
+        self.last_merge_stats = {}
+        self._buffer = None
+        self._buffer_samples = 0.0
+        self._buffer_staleness = []
+        self._buffer_lock = threading.Lock()
+        # Earlier model versions, kept so full-weight updates can be turned into deltas
+        self._versions = {}
         
         self.vocab_size = vocab_size
         self.seq_length = seq_length
 
     def register_clients(self, clients):
         """Registers clients in DB"""
+        self.db_manager.register_clients_bulk(
+            (client.client_id, client.public_key_str) for client in clients
+        )
         for client in clients:
-            self.db_manager.register_client(client.client_id, client.public_key_str)
+            self.key_registry.invalidate(client.client_id)
 
     def aggregate_updates(self, round_id):
-        """Fetches updates from DB, verifies, decrypts, and aggregates"""
+        """Fetches updates from DB, verifies, decrypts, and aggregates.
+
+        Runs as a staged pipeline: one joined query streams the rows together with
+        their clients' public keys on this thread (the DB connection is not
+        thread-safe), decrypt+verify and decode run on a thread pool (the
+        cryptography primitives release the GIL), and results are folded into the
+        aggregate in submission order. Per-stage timings are kept in
+        last_aggregation_stats and the process metrics; pool stages are summed
+        across threads, so they can exceed the wall-clock total.
         
-        updates_rows = self.db_manager.get_updates_for_round(round_id)
-        print(f"Server: Found {len(updates_rows)} updates for Round {round_id}")
+        If reading the round from the ledger fails part-way, the error propagates and
+        the global model is left unchanged.
+        """
+        stats = {"updates": 0, "valid": 0, "fetch": 0.0, "decrypt": 0.0, "verify": 0.0, "decode": 0.0, "fold": 0.0}
+        started = time.perf_counter()
         
-        valid_updates_W = []
-        valid_updates_b = []
+        # 1. Stream the round's updates, each joined with its client's public key
+        rows = self.db_manager.iter_updates_with_keys(round_id)
+        # Delta updates are relative to the global model this round was trained from
+        aggregator = StreamingFedAvg(base=self.global_model.get_parameters())
+        pending = deque()
         
-        for row in updates_rows:
-            client_id, enc_data, nonce, tag, signature = row
-            
-            # 1. Fetch Client's Public Key
-            pem_key = self.db_manager.get_client_public_key(client_id)
-            if not pem_key:
-                print(f"Unknown client {client_id}, skipping.")
-                continue
+        with ThreadPoolExecutor(max_workers=self.aggregation_threads) as pool:
+            while True:
+                t = time.perf_counter()
+                row = next(rows, None)
+                stats["fetch"] += time.perf_counter() - t
+                if row is None:
+                    break
+                stats["updates"] += 1
                 
-            public_key = KeyManager.load_public_key(pem_key)
-            
-            # 2. Decrypt
-            try:
-                decrypted_json = CryptoModule.decrypt_update(self.shared_key, enc_data, nonce, tag)
-            except Exception as e:
-                print(f"Decryption failed for {client_id}: {e}")
-                continue
-            
-            # 3. Verify Signature
-            if not CryptoModule.verify_signature(public_key, decrypted_json, signature):
-                print(f"Invalid signature from {client_id}! Possible tampering.")
-                continue
+                client_id, pem_key = row[0], row[5]
+                if not pem_key:
+                    print(f"Unknown client {client_id}, skipping.")
+                    continue
+                # Parsed keys are cached across rounds; only new/changed PEMs are parsed
+                public_key = self.key_registry.get(client_id, pem_key)
                 
-            # 4. Parse Data
-            update_data = json.loads(decrypted_json)
-            valid_updates_W.append(np.array(update_data["W"]))
-            valid_updates_b.append(np.array(update_data["b"]))
+                # 2-4. Decrypt, verify and decode on the pool
+                pending.append(pool.submit(self._open_update, row[:5], public_key, round_id))
+                # Bounded: wait for the oldest update before admitting more
+                if len(pending) >= self.max_in_flight:
+                    self._fold_update(pending.popleft().result(), aggregator, stats)
             
-        if not valid_updates_W:
+            while pending:
+                self._fold_update(pending.popleft().result(), aggregator, stats)
+        
+        print(f"Server: Found {stats['updates']} updates for Round {round_id}")
+        stats["valid"] = aggregator.count
+        stats["total"] = time.perf_counter() - started
+        self.last_aggregation_stats = stats
+        for stage, timer in _STAGE_TIMERS:
+            timer.observe(stats[stage])
+        _VALID_UPDATES.inc(stats["valid"])
+        _REJECTED_UPDATES.inc(stats["updates"] - stats["valid"])
+        print("Server: Aggregation timings (s) - " + ", ".join(
+            f"{k}: {stats[k]:.4f}" for k in AGGREGATION_STAGES))
+            
+        if aggregator.count == 0:
             print("No valid updates received.")
             return
 
-        # 5. FedAvg (Simple Averaging)
-        avg_W = np.mean(valid_updates_W, axis=0)
-        avg_b = np.mean(valid_updates_b, axis=0)
+        avg_W, avg_b = aggregator.result()
+        
+        # Update Global Model; averaging ran in float64, keep the model's own dtype
+        dtype = self.global_model.dtype
+        self.global_model.set_parameters(avg_W.astype(dtype, copy=False), avg_b.astype(dtype, copy=False))
+        self.model_version += 1
+        print(f"Server: Global model updated for Round {round_id} "
+              f"({aggregator.count} updates, {int(aggregator.total_weight)} samples).")
+
+    def receive_update(self, package, base_version, round_id):
+        """Asynchronous mode: verify one client's update and add it to the buffer.
+
+        base_version is the model_version the client trained from and round_id the
+        ledger round its update is signed for. Returns True if this update filled
+        the buffer and a new global model version was merged.
+        """
+        if self.buffer_size is None:
+            raise ValueError("receive_update needs a server created with a buffer_size")
+        client_id = package["client_id"]
+        public_key = self.key_registry.lookup(client_id)
+        if public_key is None:
+            print(f"Unknown client {client_id}, skipping.")
+            _REJECTED_ASYNC_UPDATES.inc()
+            return False
+        row = (client_id, package["encrypted_data"], package["nonce"], package["tag"], package["signature"])
+        # Decrypt, verify and decode outside the lock; only folding is serialized
+        _, error, parsed, _ = self._open_update(row, public_key, round_id)
+        if error:
+            print(error)
+            _REJECTED_ASYNC_UPDATES.inc()
+            return False
+        
+        with self._buffer_lock:
+            staleness = self.model_version - base_version
+            base = self._version_parameters(base_version)
+            if base is None:
+                print(f"Dropping update from {client_id}: trained from version {base_version}, "
+                      f"global model is at {self.model_version}")
+                _STALE_UPDATES.inc()
+                return False
+            
+            if self._buffer is None:
+                # The global model only changes on merge, so it is the base of every delta in the buffer
+                self._buffer = StreamingFedAvg(base=self.global_model.get_parameters())
+            form, tensors, b, num_samples = parsed
+            if num_samples <= 0:
+                print(f"Dropping update from {client_id}: no training samples")
+                _REJECTED_ASYNC_UPDATES.inc()
+                return False
+            weight = num_samples * (1.0 + staleness) ** -self.staleness_exponent
+            try:
+                if form == "weights":
+                    # Full weights are relative to the version the client started from
+                    self._buffer.add_delta(tensors - base[0], b - base[1], weight=weight)
+                elif form == "dense":
+                    self._buffer.add_delta(tensors, b, weight=weight)
+                else:
+                    indices, values, shape = tensors
+                    self._buffer.add_sparse_delta(indices, values, shape, b, weight=weight)
+            except ValueError as e:
+                print(f"Malformed update from {client_id}: {e}")
+                _REJECTED_ASYNC_UPDATES.inc()
+                return False
+            self._buffer_samples += num_samples
+            self._buffer_staleness.append(staleness)
+            _BUFFERED_UPDATES.inc()
+            _STALENESS.observe(staleness)
+            
+            if self._buffer.count < self.buffer_size:
+                return False
+            self._merge_buffer()
+            return True
+
+    def flush_buffer(self):
+        """Merges a partly filled buffer, e.g. when training stops; True if there was one"""
+        with self._buffer_lock:
+            if self._buffer is None or self._buffer.count == 0:
+                return False
+            self._merge_buffer()
+            return True
+
+    def _version_parameters(self, version):
+        if version == self.model_version:
+            return self.global_model.get_parameters()
+        if self.model_version - version > self.max_staleness:
+            return None
+        return self._versions.get(version)
+
+    def _merge_buffer(self):
+        buffer = self._buffer
+        avg_W, avg_b = buffer.result()
+        base_W, base_b = buffer.base
+        # The average is weighted by samples * staleness scale, which would cancel the
+        # scale if every update were equally stale; step by the mean scale instead
+        step = self.server_lr * buffer.total_weight / self._buffer_samples
+        for avg, base in ((avg_W, base_W), (avg_b, base_b)):
+            avg -= base
+            avg *= step
+            avg += base
+        
+        dtype = self.global_model.dtype
+        self._versions[self.model_version] = (base_W, base_b)
+        self.global_model.set_parameters(avg_W.astype(dtype, copy=False), avg_b.astype(dtype, copy=False))
+        self.model_version += 1
+        for version in [v for v in self._versions if self.model_version - v > self.max_staleness]:
+            del self._versions[version]
+        
+        self.last_merge_stats = {
+            "version": self.model_version,
+            "updates": buffer.count,
+            "samples": self._buffer_samples,
+            "mean_staleness": float(np.mean(self._buffer_staleness)),
+            "max_staleness": max(self._buffer_staleness),
+        }
+        self._buffer = None
+        self._buffer_samples = 0.0
+        self._buffer_staleness = []
+        _MERGES.inc()
+        print(f"Server: Merged {buffer.count} buffered updates into model version {self.model_version} "
+              f"(mean staleness {self.last_merge_stats['mean_staleness']:.2f}).")
+
+    def _open_update(self, row, public_key, round_id):
+        """Pipeline worker: decrypt, verify and decode one ledger row.
+
+        Returns (client_id, error, parsed, timings); error is None on success.
+        """
+        client_id, enc_data, nonce, tag, signature = row
+        timings = {}
+        t = time.perf_counter()
+        
+        # 2. Decrypt
+        try:
+            plaintext = CryptoModule.decrypt_update(self.shared_key, enc_data, nonce, tag, as_text=False)
+        except Exception as e:
+            return client_id, f"Decryption failed for {client_id}: {e}", None, timings
+        timings["decrypt"] = time.perf_counter() - t
+        t = time.perf_counter()
+        
+        # 3. Verify Signature
+        if not CryptoModule.verify_signature(public_key, plaintext, signature):
+            return client_id, f"Invalid signature from {client_id}! Possible tampering.", None, timings
+        timings["verify"] = time.perf_counter() - t
+        
+        # 4. Parse Data
+        t = time.perf_counter()
+        try:
+            parsed = self._parse_update(plaintext, client_id, round_id)
+        except (ValueError, KeyError) as e: # WireFormatError and CompressionError are ValueErrors
+            return client_id, f"Malformed update from {client_id}: {e}", None, timings
+        timings["decode"] = time.perf_counter() - t
+        return client_id, None, parsed, timings
+
+    def _fold_update(self, result, aggregator, stats):
+        """5. Fold a decoded update into the weighted FedAvg, then release it"""
+        client_id, error, parsed, timings = result
+        for stage, seconds in timings.items():
+            stats[stage] += seconds
+        if error:
+            print(error)
+            return
+        
+        t = time.perf_counter()
+        form, tensors, b, num_samples = parsed
+        try:
+            if form == "weights":
+                aggregator.add(tensors, b, weight=num_samples)
+            elif form == "dense":
+                aggregator.add_delta(tensors, b, weight=num_samples)
+            else:
+                indices, values, shape = tensors
+                aggregator.add_sparse_delta(indices, values, shape, b, weight=num_samples)
+        except ValueError as e:
+            print(f"Malformed update from {client_id}: {e}")
+        stats["fold"] += time.perf_counter() - t
+
+    def _parse_update(self, plaintext, client_id, round_id):
+        """Decode a verified update into (form, tensors, b, num_samples).
+
+        form is "weights" (tensors = W), "dense" (a delta W) or "sparse" (a delta as
+        (flat indices, values, shape)). Uncompressed binary tensors are zero-copy
+        views of plaintext; quantized deltas are dequantized here, on the pool.
+        """
+        if not is_binary_update(plaintext):
+            # Legacy JSON-encoded update
+            update_data = json.loads(plaintext)
+            return "weights", np.array(update_data["W"]), np.array(update_data["b"]), update_data.get("num_samples", 1)
+        
+        update = decode_update(plaintext)
+        if update["client_id"] != client_id or update["round_id"] != round_id:
+            raise WireFormatError(
+                f"Update is for {update['client_id']} round {update['round_id']}, "
+                f"stored under {client_id} round {round_id}"
+            )
+        if update["kind"] != KIND_DELTA:
+            return "weights", update["W"], update["b"], update["num_samples"]
         
-        # Update Global Model
-        self.global_model.set_parameters(avg_W, avg_b)
-        print(f"Server: Global model updated for Round {round_id}.")
+        codec = CODEC_NAMES.get(update["codec"])
+        if codec is None:
+            raise WireFormatError(f"Unknown codec id {update['codec']}")
+        decoded = decompress(update["sections"], codec, update["shape"], dtype=update["b"].dtype)
+        if decoded[0] == "dense":
+            return "dense", decoded[1], update["b"], update["num_samples"]
+        return "sparse", (decoded[1], decoded[2], update["shape"]), update["b"], update["num_samples"]
 
     def evaluate(self, test_X, test_y):
+        # test_X may be (batch, seq_length) index inputs or dense one-hot rows
         # Compute Loss
         loss = self.global_model.compute_loss(test_X, test_y)
         
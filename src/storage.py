@@ -0,0 +1,350 @@
+import hashlib
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+try:
+    import mysql.connector
+    _MYSQL_ERRORS = (mysql.connector.Error,)
+except ImportError: # SQLite-only installs
+    mysql = None
+    _MYSQL_ERRORS = ()
+
+# Every error a storage backend raises; DBManager methods catch this
+Error = _MYSQL_ERRORS + (sqlite3.Error,)
+
+
+class StorageBackend:
+    """Connection handling and SQL dialect for one kind of database.
+
+    DBManager writes every query once, in MySQL syntax with %s placeholders;
+    backends translate it with sql() and own pooling, transactions and the
+    statements that have no common form.
+    """
+    name = None
+
+    def pool_key(self):
+        raise NotImplementedError
+
+    def checkout(self):
+        """Borrow a connection from the process-wide pool"""
+        raise NotImplementedError
+
+    def release(self, conn):
+        """Return a connection to the pool"""
+        raise NotImplementedError
+
+    def prepare_schema(self, cursor):
+        """Runs once per process before migrations"""
+        pass
+
+    def sql(self, statement):
+        """Translates a statement (MySQL syntax, %s placeholders) to this dialect.
+
+        A statement may also be a dict of per-backend variants keyed by name.
+        """
+        if isinstance(statement, dict):
+            return statement[self.name]
+        return statement
+
+    def begin(self, conn):
+        raise NotImplementedError
+
+    def in_transaction(self, conn):
+        return conn.in_transaction
+
+    def is_already_applied(self, error):
+        """True if a migration statement failed because it had already been applied"""
+        return False
+
+    def is_rejected_row(self, error):
+        """True if a write failed because of the data (constraint, bad value), so
+        retrying it can never succeed; False for lock timeouts, lost connections..."""
+        return False
+
+    def reset_statements(self):
+        """Statements that empty every table and restart the id counters"""
+        raise NotImplementedError
+
+
+class _ConnectionPool:
+    """Bounded pool of connections shared by all threads of a process.
+
+    Idle connections are kept newest first, each with the time it was handed
+    back, so the backend can decide whether it needs a health check.
+    """
+    def __init__(self, connect, size, timeout_error):
+        self._connect = connect
+        self._timeout_error = timeout_error
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def get(self, timeout):
+        """(connection, monotonic time it went idle, or None if it was just opened)"""
+        if not self._slots.acquire(timeout=timeout):
+            raise self._timeout_error("Timed out waiting for a pooled database connection")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect(), None
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def put(self, conn):
+        self._idle.put((conn, time.monotonic()))
+        self._slots.release()
+
+    def discard(self):
+        """Frees the slot of a checked-out connection that was closed instead of returned"""
+        self._slots.release()
+
+
+class MySQLBackend(StorageBackend):
+    """MySQL over a pool of raw connections managed here.
+
+    mysql.connector's own pool pings the server on every checkout; this one only
+    pings connections that sat idle longer than DB_POOL_PING_INTERVAL, so a busy
+    worker pays no extra round trip per request.
+    """
+    name = "mysql"
+
+    _pools = {}
+    _pool_lock = threading.Lock()
+
+    # Duplicate column / duplicate index name
+    _ALREADY_APPLIED_ERRNOS = {1060, 1061}
+
+    def __init__(self, host=None, user=None, password=None, database=None, port=None):
+        if mysql is None:
+            raise RuntimeError("mysql-connector-python is not installed; set DB_BACKEND=sqlite to run without it")
+        self.config = {
+            'host': host or os.getenv('DB_HOST', 'mysql.gb.stackcp.com'),
+            'user': user or os.getenv('DB_USER', 'Nam'),
+            'password': password or os.getenv('DB_PASSWORD', 'S@i85t@run'),
+            'port': port or int(os.getenv('DB_PORT', 41286)),
+            'database': database or os.getenv('DB_NAME', 'nam-project-313937c3b4'),
+            'connection_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 10)),
+            # Pooled connections are shared across requests, so no connection may be
+            # returned with an open (snapshot-holding) read transaction
+            'autocommit': True
+        }
+        self.database = self.config['database']
+        # Pool sizing: one connection per gunicorn thread plus the simulation thread
+        self.pool_size = int(os.getenv('DB_POOL_SIZE', 5))
+        # Seconds to wait for a free pooled connection before giving up
+        self.pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', 10))
+        # Connections idle longer than this are pinged (and reconnected) on checkout
+        self.ping_interval = float(os.getenv('DB_POOL_PING_INTERVAL', 30))
+
+    def pool_key(self):
+        return (self.name,) + tuple(sorted((k, str(v)) for k, v in self.config.items()))
+
+    def _get_pool(self):
+        key = self.pool_key()
+        with MySQLBackend._pool_lock:
+            pool = MySQLBackend._pools.get(key)
+            if pool is None:
+                pool = MySQLBackend._pools[key] = _ConnectionPool(
+                    lambda: mysql.connector.connect(**self.config),
+                    self.pool_size, mysql.connector.errors.PoolError)
+            return pool
+
+    def checkout(self):
+        """Borrow a pooled connection, waiting up to pool_timeout for one to free up"""
+        pool = self._get_pool()
+        conn, idle_since = pool.get(self.pool_timeout)
+
+        # Health check: only connections that sat idle long enough to be dropped
+        # by the server pay for a ping round trip
+        if idle_since is not None and time.monotonic() - idle_since > self.ping_interval:
+            try:
+                conn.ping(reconnect=True, attempts=2, delay=0)
+            except Error:
+                self._discard(pool, conn)
+                raise
+        return conn
+
+    def release(self, conn):
+        pool = self._get_pool()
+        try:
+            # Never hand the next user an open transaction or an unread result
+            if conn.in_transaction or conn.unread_result:
+                conn.rollback()
+        except Error:
+            # Broken connection; drop it rather than pool it
+            self._discard(pool, conn)
+            return
+        pool.put(conn)
+
+    @staticmethod
+    def _discard(pool, conn):
+        try:
+            conn.close()
+        except Error:
+            pass
+        pool.discard()
+
+    def prepare_schema(self, cursor):
+        # cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.database}") # Not allowed on shared hosting
+        cursor.execute(f"USE `{self.database}`")
+
+    def begin(self, conn):
+        conn.start_transaction()
+
+    def is_already_applied(self, error):
+        return getattr(error, 'errno', None) in self._ALREADY_APPLIED_ERRNOS
+
+    def is_rejected_row(self, error):
+        return isinstance(error, (mysql.connector.errors.IntegrityError, mysql.connector.errors.DataError))
+
+    def reset_statements(self):
+        return [
+            # Disable FK checks to truncate tables freely
+            "SET FOREIGN_KEY_CHECKS = 0",
+            "TRUNCATE TABLE updates",
+            "TRUNCATE TABLE rounds",
+            "TRUNCATE TABLE global_models",
+            "TRUNCATE TABLE clients",
+            "SET FOREIGN_KEY_CHECKS = 1",
+        ]
+
+
+def _sqlite_sha2(value, bits):
+    if value is None or bits != 256:
+        return None
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return hashlib.sha256(value).hexdigest()
+
+
+def _sqlite_timestamp(value):
+    # CURRENT_TIMESTAMP is stored as UTC text; hand back naive datetimes like MySQL does
+    return datetime.fromisoformat(value.decode())
+
+
+sqlite3.register_converter("TIMESTAMP", _sqlite_timestamp)
+
+
+class SQLiteBackend(StorageBackend):
+    """Embedded ledger in a single SQLite file (WAL mode), for local and single-node runs.
+
+    DB_PATH=:memory: keeps the ledger in process memory, shared by every pooled
+    connection, for benchmarks and throwaway runs.
+    """
+    name = "sqlite"
+
+    _pools = {}
+    _pool_lock = threading.Lock()
+
+    _TRANSLATIONS = [
+        (re.compile(r"%s"), "?"),
+        (re.compile(r"\bINSERT IGNORE\b"), "INSERT OR IGNORE"),
+        (re.compile(r"\bINT AUTO_INCREMENT PRIMARY KEY\b"), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    ]
+
+    def __init__(self, path=None):
+        path = path or os.getenv('DB_PATH') or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fl_ledger.db')
+        if path == ':memory:':
+            # One named shared-cache database per process; it lives as long as a
+            # pooled connection to it is open
+            path = f"file:fl_ledger_{os.getpid()}?mode=memory&cache=shared"
+            self.memory = True
+        else:
+            path = os.path.abspath(path)
+            self.memory = False
+        self.path = path
+        self.pool_size = int(os.getenv('DB_POOL_SIZE', 5))
+        self.pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', 10))
+        self._translated = {}
+
+    def pool_key(self):
+        return (self.name, self.path)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            uri=self.memory,
+            timeout=self.pool_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            # Pooled connections move between threads, one user at a time
+            check_same_thread=False,
+            # Autocommit; round_transaction() issues BEGIN explicitly
+            isolation_level=None,
+        )
+        conn.create_function("SHA2", 2, _sqlite_sha2, deterministic=True)
+        conn.execute("PRAGMA foreign_keys = ON")
+        if not self.memory:
+            # Readers don't block the writer; NORMAL fsyncs at checkpoints, not every commit
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def checkout(self):
+        key = self.pool_key()
+        with SQLiteBackend._pool_lock:
+            pool = SQLiteBackend._pools.get(key)
+            if pool is None:
+                pool = SQLiteBackend._pools[key] = _ConnectionPool(
+                    self._connect, self.pool_size, sqlite3.OperationalError)
+        return pool.get(self.pool_timeout)[0]
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        SQLiteBackend._pools[self.pool_key()].put(conn)
+
+    def sql(self, statement):
+        if isinstance(statement, dict):
+            return statement[self.name]
+        translated = self._translated.get(statement)
+        if translated is None:
+            translated = statement
+            for pattern, replacement in self._TRANSLATIONS:
+                translated = pattern.sub(replacement, translated)
+            self._translated[statement] = translated
+        return translated
+
+    def begin(self, conn):
+        conn.execute("BEGIN")
+
+    def is_already_applied(self, error):
+        message = str(error)
+        return "duplicate column name" in message or "already exists" in message
+
+    def is_rejected_row(self, error):
+        return isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError))
+
+    def reset_statements(self):
+        return [
+            # Children first, so foreign keys hold throughout
+            "DELETE FROM updates",
+            "DELETE FROM global_models",
+            "DELETE FROM rounds",
+            "DELETE FROM clients",
+            # Restart AUTOINCREMENT ids, as TRUNCATE does
+            "DELETE FROM sqlite_sequence WHERE name IN ('updates', 'rounds', 'global_models')",
+        ]
+
+
+BACKENDS = {
+    "mysql": MySQLBackend,
+    "sqlite": SQLiteBackend,
+}
+
+
+def backend_from_env(**mysql_config):
+    """Backend selected by DB_BACKEND (mysql by default). mysql_config goes to MySQLBackend."""
+    name = os.getenv('DB_BACKEND', 'mysql').lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown DB_BACKEND {name!r}, expected one of {sorted(BACKENDS)}")
+    if name == "mysql":
+        return MySQLBackend(**mysql_config)
+    return SQLiteBackend()
@@ -0,0 +1,206 @@
+import struct
+import numpy as np
+
+# Binary model-update format (little-endian):
+#   header   : magic "FLUP", version, dtype code, client_id length, round_id,
+#              num_samples (v2+; v1 updates count as one sample),
+#              kind and codec (v3+; see below)
+#   client_id: utf-8 bytes
+#   shapes   : W rows, W cols, b length
+#   sections : (v3+) section count, then a dtype code and element count per section
+#   padding  : zero bytes up to an 8-byte boundary so tensors are aligned
+#   tensors  : v1/v2: raw W bytes (C order) followed by raw b bytes
+#              v3: each section's raw bytes, each padded to 8 bytes; b is the last
+#
+# v3 updates are either full weights (KIND_WEIGHTS: sections W, b) or a delta from
+# the round's global model (KIND_DELTA) whose W part is encoded by one of the
+# codecs in src/compression.py; the codec id is stored opaquely here.
+MAGIC = b"FLUP"
+VERSION = 3
+
+KIND_WEIGHTS = 0
+KIND_DELTA = 1
+
+_HEADERS = {
+    1: struct.Struct("<4sBBHi"),
+    2: struct.Struct("<4sBBHiI"),
+    3: struct.Struct("<4sBBHiIBBxx"),
+}
+_PREFIX = struct.Struct("<4sB")
+_SHAPES = struct.Struct("<III")
+_SECTION_COUNT = struct.Struct("<I")
+_SECTION = struct.Struct("<BxxxI")
+
+DTYPE_CODES = {
+    np.dtype('<f8'): 1,
+    np.dtype('<f4'): 2,
+    np.dtype('<f2'): 3,
+}
+CODE_DTYPES = {code: dtype for dtype, code in DTYPE_CODES.items()}
+
+# Section element types: the model dtypes plus what codecs produce
+SECTION_DTYPE_CODES = {
+    **DTYPE_CODES,
+    np.dtype('i1'): 4,
+    np.dtype('u1'): 5,
+    np.dtype('<u2'): 6,
+    np.dtype('<u4'): 7,
+}
+CODE_SECTION_DTYPES = {code: dtype for dtype, code in SECTION_DTYPE_CODES.items()}
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+def is_binary_update(payload):
+    """True if payload starts with the binary update magic (legacy updates are JSON)"""
+    return bytes(payload[:len(MAGIC)]) == MAGIC
+
+
+def encode_update(client_id, round_id, W, b, num_samples=1):
+    """Serialize a weight update to bytes; num_samples weights it in aggregation"""
+    dtype = _model_dtype(W)
+    return _encode(client_id, round_id, num_samples, KIND_WEIGHTS, 0, dtype, W.shape,
+                   [np.ascontiguousarray(W, dtype=dtype).reshape(-1), np.ascontiguousarray(b, dtype=dtype)])
+
+
+def encode_delta_update(client_id, round_id, codec_id, sections, shape, b_delta, num_samples=1):
+    """Serialize a compressed delta (see src/compression.py) of a W of the given shape.
+
+    b_delta is sent uncompressed; its dtype is recorded as the model dtype.
+    """
+    dtype = _model_dtype(b_delta)
+    return _encode(client_id, round_id, num_samples, KIND_DELTA, codec_id, dtype, shape,
+                   list(sections) + [np.ascontiguousarray(b_delta, dtype=dtype)])
+
+
+def _model_dtype(array):
+    dtype = np.dtype(array.dtype).newbyteorder('<')
+    if dtype not in DTYPE_CODES:
+        raise WireFormatError(f"Unsupported dtype {array.dtype}")
+    return dtype
+
+
+def _encode(client_id, round_id, num_samples, kind, codec_id, dtype, shape, sections):
+    client_bytes = client_id.encode('utf-8')
+    sections = [np.ascontiguousarray(s).reshape(-1) for s in sections]
+    
+    parts = [
+        _HEADERS[VERSION].pack(MAGIC, VERSION, DTYPE_CODES[dtype], len(client_bytes), round_id,
+                               num_samples, kind, codec_id),
+        client_bytes,
+        _SHAPES.pack(shape[0], shape[1], sections[-1].shape[0]),
+        _SECTION_COUNT.pack(len(sections)),
+    ]
+    for section in sections:
+        section_dtype = section.dtype.newbyteorder('<') if section.dtype.itemsize > 1 else section.dtype
+        if section_dtype not in SECTION_DTYPE_CODES:
+            raise WireFormatError(f"Unsupported section dtype {section.dtype}")
+        parts.append(_SECTION.pack(SECTION_DTYPE_CODES[section_dtype], section.shape[0]))
+    size = sum(len(p) for p in parts)
+    parts.append(b"\0" * (-size % 8))
+    
+    for section in sections:
+        data = section.astype(section.dtype.newbyteorder('<'), copy=False).tobytes()
+        parts.append(data)
+        parts.append(b"\0" * (-len(data) % 8))
+    return b"".join(parts)
+
+
+def decode_update(payload):
+    """Parse bytes produced by encode_update or encode_delta_update.
+
+    Returns a dict with client_id, round_id, num_samples, kind, codec, shape and b.
+    Full-weight updates also have W; deltas have sections (the codec's arrays,
+    without b). All arrays are read-only np.frombuffer views into payload.
+    """
+    view = memoryview(payload)
+    if len(view) < _PREFIX.size:
+        raise WireFormatError("Update too short")
+    magic, version = _PREFIX.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise WireFormatError("Not a binary update")
+    if version not in _HEADERS:
+        raise WireFormatError(f"Unsupported update version {version}")
+    header = _HEADERS[version]
+    if len(view) < header.size:
+        raise WireFormatError("Update too short")
+    fields = header.unpack_from(view, 0)
+    dtype_code, client_len, round_id = fields[2:5]
+    num_samples = fields[5] if version >= 2 else 1
+    if dtype_code not in CODE_DTYPES:
+        raise WireFormatError(f"Unknown dtype code {dtype_code}")
+    dtype = CODE_DTYPES[dtype_code]
+    
+    kind, codec = fields[6:8] if version >= 3 else (KIND_WEIGHTS, 0)
+    
+    offset = header.size
+    if len(view) < offset + client_len + _SHAPES.size:
+        raise WireFormatError("Update too short")
+    client_id = bytes(view[offset:offset + client_len]).decode('utf-8')
+    offset += client_len
+    rows, cols, bias_len = _SHAPES.unpack_from(view, offset)
+    offset += _SHAPES.size
+    
+    if version >= 3:
+        sections = _read_sections(view, offset)
+    else:
+        offset += -offset % 8
+        expected = offset + (rows * cols + bias_len) * dtype.itemsize
+        if len(view) != expected:
+            raise WireFormatError(f"Update size {len(view)} does not match header ({expected} bytes)")
+        W = np.frombuffer(view, dtype=dtype, count=rows * cols, offset=offset)
+        offset += rows * cols * dtype.itemsize
+        sections = [W, np.frombuffer(view, dtype=dtype, count=bias_len, offset=offset)]
+    
+    b = sections.pop()
+    if b.dtype != dtype or b.shape[0] != bias_len:
+        raise WireFormatError("Bias section does not match header")
+    update = {
+        "client_id": client_id,
+        "round_id": round_id,
+        "num_samples": num_samples,
+        "kind": kind,
+        "codec": codec,
+        "shape": (rows, cols),
+        "b": b
+    }
+    if kind == KIND_WEIGHTS:
+        if len(sections) != 1 or sections[0].dtype != dtype or sections[0].shape[0] != rows * cols:
+            raise WireFormatError("Weight section does not match header")
+        update["W"] = sections[0].reshape(rows, cols)
+    elif kind == KIND_DELTA:
+        update["sections"] = sections
+    else:
+        raise WireFormatError(f"Unknown update kind {kind}")
+    return update
+
+
+def _read_sections(view, offset):
+    if len(view) < offset + _SECTION_COUNT.size:
+        raise WireFormatError("Update too short")
+    (count,) = _SECTION_COUNT.unpack_from(view, offset)
+    offset += _SECTION_COUNT.size
+    if count == 0 or len(view) < offset + count * _SECTION.size:
+        raise WireFormatError("Bad section table")
+    
+    table = []
+    for _ in range(count):
+        dtype_code, length = _SECTION.unpack_from(view, offset)
+        offset += _SECTION.size
+        if dtype_code not in CODE_SECTION_DTYPES:
+            raise WireFormatError(f"Unknown section dtype code {dtype_code}")
+        table.append((CODE_SECTION_DTYPES[dtype_code], length))
+    offset += -offset % 8
+    
+    sections = []
+    for dtype, length in table:
+        nbytes = length * dtype.itemsize
+        if len(view) < offset + nbytes:
+            raise WireFormatError("Update truncated")
+        sections.append(np.frombuffer(view, dtype=dtype, count=length, offset=offset))
+        offset += nbytes + (-nbytes % 8)
+    if len(view) != offset:
+        raise WireFormatError(f"Update size {len(view)} does not match header ({offset} bytes)")
+    return sections
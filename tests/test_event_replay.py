@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, 'web_app', 'backend'))
+
+import simulation_runner
+
+
+def replay_chart(events):
+    """The rounds App.jsx charts after replaying events: a reset/snapshot replaces
+    the series, each metrics event appends one round"""
+    rounds = []
+    for _, event, data in events:
+        if event in ("reset", "snapshot"):
+            rounds = list(data["metrics"]["rounds"])
+        elif event == "metrics":
+            rounds.append(data["round"])
+    return rounds
+
+
+class EventReplayTest(unittest.TestCase):
+    def test_resume_from_before_reset_sees_each_round_once(self):
+        runner = simulation_runner.SimulationRunner("unused", num_rounds=2)
+        runner.record_metrics(1, 2.0, 0.1)
+        last_id = simulation_runner.events.last_id
+
+        runner.reset_state()
+        runner.record_metrics(1, 1.5, 0.2)
+        runner.record_metrics(2, 1.2, 0.3)
+
+        events = simulation_runner.events.since(last_id)
+        self.assertEqual(replay_chart(events), [1, 2])
+
+    def test_snapshot_shares_nothing_with_live_state(self):
+        state = simulation_runner.snapshot()
+        state["metrics"]["rounds"].append(99)
+        state["logs"].append("x")
+        self.assertNotIn(99, simulation_runner.simulation_state["metrics"]["rounds"])
+        self.assertNotIn("x", simulation_runner.simulation_state["logs"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,9 @@
+import atexit
 import os
 import threading
 import time
 import pytz
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context, g
 from flask_cors import CORS
 import sys
 import json
@@ -13,13 +14,85 @@ project_root = os.path.dirname(os.path.dirname(current_dir))
 sys.path.append(project_root)
 
 from src.db_manager import DBManager
+from src.checkpoint import CheckpointError
+from src.metrics import REGISTRY, CONTENT_TYPE
+from model_cache import ModelCache
+from response_cache import ResponseCache
+from event_stream import format_event
+from update_writer import UpdateRefs, UpdateWriter
 import simulation_runner
 
 app = Flask(__name__)
-CORS(app)
+# Let browser clients read the caching and pagination headers
+CORS(app, expose_headers=["ETag", "Link", "X-Next-Cursor", "X-Model-Round", "X-Model-Base-Round"])
 
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'S@i85t@run')
 
+def init_database():
+    """Warm the connection pool and create the schema once at start-up.
+
+    Requests then only borrow a pooled connection. If the DB is unreachable now,
+    the first request's connect() retries the schema setup.
+    """
+    db = None
+    try:
+        db = DBManager(password=DB_PASSWORD)
+        db.connect()
+    except Exception as e:
+        print(f"Database initialization deferred: {e}")
+    finally:
+        if db:
+            db.close()
+
+init_database()
+
+def load_checkpoint_chain(round_id=None):
+    db = DBManager(password=DB_PASSWORD)
+    try:
+        db.connect()
+        return db.get_checkpoint_chain(round_id)
+    finally:
+        db.close()
+
+# Latest global model, served from memory and dropped whenever a new one is stored
+model_cache = ModelCache(load_checkpoint_chain)
+
+# Dashboard polling endpoints. Writes through DBManager invalidate these right away;
+# the TTLs only bound staleness from writes made by other processes.
+response_cache = ResponseCache()
+CLIENTS_TTL = 30
+MODEL_HISTORY_TTL = 30
+LEDGER_TTL = 10
+STATUS_TTL = 1
+
+def on_db_write(table):
+    if table == 'global_models':
+        model_cache.invalidate()
+    response_cache.invalidate(table)
+    update_refs.invalidate(table)
+
+DBManager.add_write_listener(on_db_write)
+
+# Per-route request metrics. The route label is the URL rule, not the path, so path
+# parameters don't create new series. Streaming responses are timed until their headers.
+REQUEST_SECONDS = REGISTRY.histogram(
+    "fl_http_request_seconds", "Flask request latency by route", ["method", "route"])
+REQUESTS = REGISTRY.counter(
+    "fl_http_requests_total", "Flask requests by route and status", ["method", "route", "status"])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.labels(request.method, route).observe(time.perf_counter() - started)
+        REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+    return response
+
 # =========================================================
 #  V1 API ENDPOINTS
 # =========================================================
@@ -32,6 +105,11 @@ def health():
 def index():
     return jsonify({"status": "online", "service": "Secure FL API"}), 200
 
+@app.route('/api/v1/metrics', methods=['GET'])
+def get_metrics():
+    """Counters and latency histograms of this worker process, in Prometheus text format"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 # --- Client Management ---
 @app.route('/api/v1/clients/register', methods=['POST'])
 def register_client():
@@ -56,6 +134,7 @@ def register_client():
             db.close()
 
 @app.route('/api/v1/clients', methods=['GET'])
+@response_cache.cached(CLIENTS_TTL, tables=('clients',))
 def list_clients():
     """List all registered participants"""
     db = None
@@ -98,20 +177,49 @@ def get_current_round():
 
 @app.route('/api/v1/model', methods=['GET'])
 def get_global_model():
-    """Download global model weights"""
-    # In a real implementation, fetch from DB or File Storage
-    # Here we mock it or fetch from the live server instance if accessible
-    # For now, return a placeholder or the last checkpoint
+    """Download the latest global model as a binary checkpoint (see src/checkpoint.py).
+
+    ?since=<round> returns only the delta from that round's model. Responses carry
+    an ETag, and If-None-Match requests for an unchanged model get 304.
+    """
+    since = request.args.get('since', type=int)
+    try:
+        entry = model_cache.delta_since(since) if since is not None else model_cache.latest()
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except CheckpointError as e:
+        return jsonify({"error": f"Stored checkpoint is unreadable: {e}"}), 500
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    response = Response(entry["blob"], mimetype='application/octet-stream')
+    response.set_etag(entry["etag"])
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Model-Round'] = str(entry["round_id"])
+    if entry["base_round_id"] is not None:
+        response.headers['X-Model-Base-Round'] = str(entry["base_round_id"])
+    return response.make_conditional(request)
+
+@app.route('/api/v1/model/info', methods=['GET'])
+def get_global_model_info():
+    """Metadata for the latest global model"""
+    try:
+        entry = model_cache.latest()
+    except LookupError:
+        return jsonify({"version": None, "round_id": None})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
     return jsonify({
-        "weights_url": "/models/global_v1.json",
-        "version": "1.0",
-        "timestamp": "2025-12-23T12:00:00Z"
+        "version": f"{entry['round_id']}.0",
+        "round_id": entry["round_id"],
+        "etag": entry["etag"],
+        "size_bytes": len(entry["blob"]),
+        "params": int(entry["W"].size + entry["b"].size),
+        "weights_url": "/api/v1/model"
     })
 
 
-
-
-
 @app.route('/api/v1/datasets', methods=['GET'])
 def list_datasets():
     """List available dataset partitions"""
@@ -170,63 +278,108 @@ def get_dataset_sample():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def open_ledger():
+    db = DBManager(password=DB_PASSWORD)
+    db.connect()
+    return db
+
+# Submitted updates are written to the ledger in batches by a background thread.
+# Flushed at exit, and by gunicorn's worker_exit hook (gunicorn_config.py).
+UPDATE_QUEUE_MAX = int(os.getenv('UPDATE_QUEUE_MAX', 1024))
+UPDATE_BATCH_SIZE = int(os.getenv('UPDATE_BATCH_SIZE', 32))
+UPDATE_RETRY_AFTER = 1
+update_writer = UpdateWriter(open_ledger, max_pending=UPDATE_QUEUE_MAX, batch_size=UPDATE_BATCH_SIZE)
+atexit.register(update_writer.close)
+# Known clients and rounds, so updates the ledger would refuse are rejected up front
+update_refs = UpdateRefs(open_ledger)
+
+UPDATE_TEXT_FIELDS = ['client_id', 'encrypted_data', 'nonce', 'tag', 'signature']
+
 @app.route('/api/v1/updates', methods=['POST'])
 def submit_update():
-    """Submit an encrypted update"""
-    data = request.json
-    required_fields = ['round_id', 'client_id', 'encrypted_data', 'nonce', 'tag', 'signature']
-    
-    if not all(k in data for k in required_fields):
+    """Submit an encrypted update.
+
+    The update is queued and written to the ledger shortly after; the response is
+    202 with its update_id, the payload_digest of its /api/v1/ledger entry. An
+    unknown client or round is refused with 400 before queuing, so a 202 is only
+    lost if the ledger is unreachable until shutdown. 429 with Retry-After means
+    the queue is full and the client should resubmit later.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid update payload"}), 400
+    round_id = data.get('round_id')
+    if (not isinstance(round_id, int) or isinstance(round_id, bool)
+            or not all(isinstance(data.get(k), str) and data[k] for k in UPDATE_TEXT_FIELDS)):
         return jsonify({"error": "Invalid update payload"}), 400
 
-    db = None
     try:
-        db = DBManager(password=DB_PASSWORD)
-        db.connect()
-        db.store_update(
-            data['round_id'],
-            data['client_id'],
-            data['encrypted_data'],
-            data['nonce'],
-            data['tag'],
-            data['signature']
-        )
-        return jsonify({"message": "Update received and stored in ledger"}), 201
+        problem = update_refs.check(data['client_id'], round_id)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        if db:
-            db.close()
+        # Can't ask the ledger; queue anyway, the writer keeps retrying and its
+        # constraint checks drop the row if it turns out to be invalid
+        print(f"Update check skipped: {e}")
+        problem = None
+    if problem:
+        return jsonify({"error": problem}), 400
+
+    row = (round_id,) + tuple(data[k] for k in UPDATE_TEXT_FIELDS)
+    if not update_writer.submit(row):
+        response = jsonify({"error": "Update queue is full, retry later"})
+        response.headers['Retry-After'] = str(UPDATE_RETRY_AFTER)
+        return response, 429
+    return jsonify({
+        "message": "Update accepted for the ledger",
+        "update_id": DBManager.payload_digest(data['encrypted_data'])
+    }), 202
 
 
 # --- Ledger & Analytics ---
 
+LEDGER_DEFAULT_PAGE_SIZE = 50
+LEDGER_MAX_PAGE_SIZE = 200
+
 @app.route('/api/v1/ledger', methods=['GET'])
+@response_cache.cached(LEDGER_TTL, tables=('updates',))
 def get_ledger():
+    """Ledger entries, newest first.
+
+    Keyset pagination: ?limit=<n> (max 200) and ?before=<update_id>. When more
+    entries exist, the cursor for the next page is in the X-Next-Cursor header
+    (and a Link rel="next" header).
+    """
+    limit = request.args.get('limit', LEDGER_DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, LEDGER_MAX_PAGE_SIZE))
+    before = request.args.get('before', type=int)
+    
     db = None
     try:
         db = DBManager(password=DB_PASSWORD)
         db.connect()
-        # Fetch last 50 updates
-        db.cursor.execute("""
-            SELECT update_id, round_id, client_id, encrypted_data, signature, timestamp 
-            FROM updates 
-            ORDER BY update_id DESC LIMIT 50
-        """)
-        rows = db.cursor.fetchall()
+        # One extra row tells us whether there is a next page
+        rows = db.get_ledger_page(before_id=before, limit=limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
+        tz = pytz.timezone('Asia/Kolkata')
         ledger_data = []
         for r in rows:
             ledger_data.append({
                 "id": r[0],
                 "round": r[1],
                 "client": r[2],
-                "data_hash": r[3][:20] + "...", 
-                "signature": r[4][:20] + "...",
-                "timestamp": r[5].astimezone(pytz.timezone('Asia/Kolkata')).strftime("%Y-%m-%d %H:%M:%S") if r[5] else ""
+                "data_hash": (r[3] or "")[:20] + "...", 
+                "payload_digest": r[3],
+                "signature": (r[4] or "") + "...",
+                "timestamp": r[5].astimezone(tz).strftime("%Y-%m-%d %H:%M:%S") if r[5] else ""
             })
             
-        return jsonify(ledger_data)
+        response = jsonify(ledger_data)
+        if has_more:
+            next_cursor = rows[-1][0]
+            response.headers['X-Next-Cursor'] = str(next_cursor)
+            response.headers['Link'] = f'<{request.path}?before={next_cursor}&limit={limit}>; rel="next"'
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -239,6 +392,7 @@ def get_ledger():
 
 
 @app.route('/api/v1/models/history', methods=['GET'])
+@response_cache.cached(MODEL_HISTORY_TTL, tables=('global_models',))
 def get_model_history():
     db = None
     try:
@@ -308,11 +462,61 @@ def reset_system():
             db.close()
 
 @app.route('/api/status', methods=['GET'])
+@response_cache.cached(STATUS_TTL)
 def get_status():
-    status_data = simulation_runner.simulation_state.copy()
-    if "error_details" not in status_data:
-         status_data["error_details"] = None
-    return jsonify(status_data)
+    return jsonify(simulation_runner.snapshot())
+
+# Each open stream holds a request thread, so only a few are allowed at once;
+# dashboards over the limit get 503 and fall back to polling /api/status.
+# Streams are also closed periodically and the browser reconnects with Last-Event-ID.
+EVENT_STREAM_SLOTS = threading.BoundedSemaphore(int(os.getenv('EVENT_STREAM_MAX_CLIENTS', 2)))
+EVENT_STREAM_MAX_SECONDS = 300
+EVENT_STREAM_KEEPALIVE = 15
+
+@app.route('/api/v1/events', methods=['GET'])
+def stream_events():
+    """Server-Sent Events stream of simulation logs, round progress, metrics and status.
+
+    The first event is a snapshot of the whole state; after that only increments
+    (log, round, metrics, status, reset) are sent. Reconnecting clients send
+    Last-Event-ID (or ?last_event_id=) and get just the events they missed.
+    """
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_event_id', type=int)
+    
+    if not EVENT_STREAM_SLOTS.acquire(blocking=False):
+        return jsonify({"error": "Too many event streams, poll /api/status instead"}), 503
+    
+    events = simulation_runner.events
+    
+    def generate():
+        cursor = last_id
+        pending = events.since(cursor) if cursor is not None else None
+        yield "retry: 2000\n\n"
+        deadline = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+        while True:
+            if pending is None:
+                # New client, or too far behind to replay: send the full state.
+                # Take the id first; an event racing the snapshot is sent twice, never lost.
+                cursor = events.last_id
+                yield format_event(cursor, "snapshot", simulation_runner.snapshot())
+            else:
+                for event_id, event, data in pending:
+                    yield format_event(event_id, event, data)
+                    cursor = event_id
+                if not pending:
+                    yield ": keep-alive\n\n"
+            if time.monotonic() >= deadline:
+                return
+            pending = events.wait(cursor, EVENT_STREAM_KEEPALIVE)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # Runs when the server closes the response, even if the client left before the first event
+    response.call_on_close(EVENT_STREAM_SLOTS.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 # Wrapper for legacy endpoint
@@ -0,0 +1,51 @@
+import json
+import threading
+from collections import deque
+
+
+class EventLog:
+    """Numbered, fixed-size history of simulation events for the SSE stream.
+
+    Every event gets the next sequence number, which doubles as its SSE id so a
+    reconnecting client can resume with Last-Event-ID. Only the newest max_events
+    are kept; a client that fell further behind than that gets a snapshot instead.
+    """
+    def __init__(self, max_events=500):
+        self._events = deque(maxlen=max_events)
+        self._cond = threading.Condition()
+        self.last_id = 0
+
+    def publish(self, event, data):
+        with self._cond:
+            self.last_id += 1
+            self._events.append((self.last_id, event, data))
+            self._cond.notify_all()
+            return self.last_id
+
+    def since(self, last_id):
+        """Events after last_id, or None if some of them were already dropped"""
+        with self._cond:
+            return self._since(last_id)
+
+    def wait(self, last_id, timeout):
+        """Like since(), but blocks up to timeout seconds for something new"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.last_id != last_id, timeout)
+            return self._since(last_id)
+
+    def _since(self, last_id):
+        if last_id == self.last_id:
+            return []
+        # An id from before a restart (ours started over) can't be resumed either
+        if last_id > self.last_id:
+            return None
+        if not self._events or self._events[0][0] > last_id + 1:
+            return None
+        # ids are contiguous, so the offset into the buffer is known
+        start = last_id + 1 - self._events[0][0]
+        return [self._events[i] for i in range(start, len(self._events))]
+
+
+def format_event(event_id, event, data):
+    """One event in text/event-stream framing"""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
@@ -1,4 +1,6 @@
 import multiprocessing
+import os
+import sys
 
 # Worker Options
 # Limit to 1 worker to prevent Out-Of-Memory (OOM) errors on Render Free Tier (512MB RAM)
@@ -8,6 +10,17 @@ workers = 1
 worker_class = 'gthread' 
 threads = 4  
 
+# Database connection pool (see DBManager): one connection per request thread plus one
+# each for the simulation thread and the update writer, so requests never wait on
+# each other for a connection. Give up on a pool checkout well before the worker
+# timeout below.
+os.environ.setdefault('DB_POOL_SIZE', str(threads + 2))
+os.environ.setdefault('DB_POOL_TIMEOUT', '10')
+os.environ.setdefault('DB_POOL_PING_INTERVAL', '30')
+
+# Each open /api/v1/events stream holds one of the threads above; leave the rest for requests
+os.environ.setdefault('EVENT_STREAM_MAX_CLIENTS', str(threads // 2))
+
 # Timeout
 # Increase to 120 seconds to prevent "WORKER TIMEOUT" during slow startups or heavy database operations
 timeout = 120 
@@ -19,3 +32,10 @@ errorlog = '-'
 
 # Bind
 bind = "0.0.0.0:10000"
+
+
+def worker_exit(server, worker):
+    # Write queued /api/v1/updates submissions before the worker goes away
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.update_writer.close()
@@ -0,0 +1,93 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from src.checkpoint import encode_checkpoint, restore_chain
+
+
+class ModelCache:
+    """In-process cache of the latest global model, ready to serve as checkpoint bytes.
+
+    The model is read from the ledger once, then served from memory until
+    invalidate() is called (when a new global model is stored). Deltas against
+    older rounds are built on demand and kept in a small LRU.
+    """
+    def __init__(self, load_chain, max_deltas=8):
+        # load_chain(round_id or None) -> checkpoint rows, see DBManager.get_checkpoint_chain
+        self.load_chain = load_chain
+        self.max_deltas = max_deltas
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._latest = None
+        self._deltas = OrderedDict()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._latest = None
+            self._deltas.clear()
+
+    def latest(self):
+        """Latest model as a dict with round_id, blob, etag, W and b.
+
+        Raises LookupError if no global model has been stored yet.
+        """
+        with self._lock:
+            if self._latest is not None:
+                return self._latest
+            generation = self._generation
+        
+        # Loaded outside the lock, so invalidate() (on the writer's thread) never
+        # waits for a DB read; concurrent misses may each load once
+        entry = self._load(None)
+        with self._lock:
+            # Don't cache a model that was superseded while it was loading
+            if generation == self._generation:
+                self._latest = entry
+        return entry
+
+    def delta_since(self, since_round):
+        """Checkpoint of the latest model as a delta against since_round"""
+        latest = self.latest()
+        with self._lock:
+            generation = self._generation
+            key = (latest["round_id"], since_round)
+            entry = self._deltas.get(key)
+            if entry is not None:
+                self._deltas.move_to_end(key)
+                return entry
+        
+        base = self._load(since_round)
+        blob = encode_checkpoint(
+            latest["W"], latest["b"], latest["round_id"],
+            base=(since_round, base["W"], base["b"])
+        )
+        entry = self._entry(latest["round_id"], blob, latest["W"], latest["b"], base_round_id=since_round)
+        with self._lock:
+            if generation != self._generation:
+                return entry
+            self._deltas[key] = entry
+            while len(self._deltas) > self.max_deltas:
+                self._deltas.popitem(last=False)
+        return entry
+
+    def _load(self, round_id):
+        rows = self.load_chain(round_id)
+        if not rows:
+            raise LookupError(f"No global model for round {round_id}" if round_id else "No global model yet")
+        round_id, W, b = restore_chain(rows)
+        # Always serve a full checkpoint, whatever form it is stored in
+        return self._entry(round_id, encode_checkpoint(W, b, round_id), W, b)
+
+    @staticmethod
+    def _entry(round_id, blob, W, b, base_round_id=None):
+        digest = hashlib.sha256(blob).hexdigest()[:16]
+        etag = f"r{round_id}-{digest}" if base_round_id is None else f"r{round_id}-since{base_round_id}-{digest}"
+        return {
+            "round_id": round_id,
+            "base_round_id": base_round_id,
+            "blob": blob,
+            "etag": etag,
+            "W": W,
+            "b": b,
+        }
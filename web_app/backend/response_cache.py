@@ -0,0 +1,95 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, request
+
+
+class ResponseCache:
+    """In-process cache of GET responses, keyed by path and query string.
+
+    Each cached view has its own TTL and the ledger tables it reads from.
+    invalidate(table) drops every entry that depends on that table, so with
+    DBManager write listeners hooked up the TTL only bounds staleness from
+    writes made outside this process. Responses carry an ETag and answer
+    If-None-Match with 304.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._entries = OrderedDict()
+
+    def cached(self, ttl, tables=()):
+        """Decorator for a Flask view. Only 200 responses are cached."""
+        tables = frozenset(tables)
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                entry = self._get(key)
+                if entry is None:
+                    generation = self._generation
+                    response = view(*args, **kwargs)
+                    if isinstance(response, tuple):
+                        return response
+                    if response.status_code != 200:
+                        return response
+                    entry = self._entry(response, ttl, tables)
+                    self._put(key, entry, generation)
+                return self._respond(entry)
+            return wrapper
+        return decorator
+
+    def invalidate(self, table=None):
+        """Drops entries that read from table, or everything if table is None"""
+        with self._lock:
+            self._generation += 1
+            if table is None:
+                self._entries.clear()
+                return
+            for key in [k for k, e in self._entries.items() if table in e["tables"]]:
+                del self._entries[key]
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires"] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, entry, generation):
+        with self._lock:
+            # A write landed while the view was running; the response may predate it
+            if generation != self._generation:
+                return
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _entry(response, ttl, tables):
+        body = response.get_data()
+        headers = [(k, v) for k, v in response.headers.items()
+                   if k not in ('Content-Length', 'ETag', 'Cache-Control')]
+        return {
+            "body": body,
+            "headers": headers,
+            "etag": hashlib.sha256(body).hexdigest()[:16],
+            "expires": time.monotonic() + ttl,
+            "tables": tables,
+        }
+
+    @staticmethod
+    def _respond(entry):
+        response = Response(entry["body"], headers=entry["headers"])
+        response.set_etag(entry["etag"])
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
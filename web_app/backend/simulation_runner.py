@@ -3,6 +3,7 @@ import os
 import threading
 import time
 import queue
+from collections import deque
 
 # Add project root to sys.path to access src modules
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -14,13 +15,18 @@ from src.data_processing import DataProcessor
 from src.client import FLClient
 from src.server import FLServer
 from src.security import KeyManager
+from src.parallel import make_client_trainer
+from src.checkpoint import CheckpointWriter
+from event_stream import EventLog
+
+MAX_LOGS = 100
 
 # Global State
 simulation_state = {
     "status": "IDLE", # IDLE, RUNNING, COMPLETED, ERROR
     "current_round": 0,
     "total_rounds": 0,
-    "logs": [],
+    "logs": deque(maxlen=MAX_LOGS), # Only the last MAX_LOGS lines are kept
     "metrics": {
         "rounds": [],
         "accuracy": [],
@@ -28,12 +34,55 @@ simulation_state = {
     }
 }
 
+# Incremental updates to simulation_state, streamed by /api/v1/events
+events = EventLog()
+
+def set_status(status, error_details=None):
+    simulation_state["status"] = status
+    simulation_state["error_details"] = error_details
+    events.publish("status", {"status": status, "error_details": error_details})
+
+def add_log(log_entry):
+    simulation_state["logs"].append(log_entry)
+    events.publish("log", {"message": log_entry})
+
+def snapshot():
+    """Copy of simulation_state that is safe to serialize.
+
+    Nothing in it is shared with the live state, so a published snapshot keeps the
+    values it had when published.
+    """
+    state = simulation_state.copy()
+    state["logs"] = list(state["logs"])
+    state["metrics"] = {k: list(v) for k, v in state["metrics"].items()}
+    state.setdefault("error_details", None)
+    return state
+
 class SimulationRunner(threading.Thread):
-    def __init__(self, db_password, num_rounds=5, num_clients=5):
+    def __init__(self, db_password, num_rounds=5, num_clients=5, num_workers=None):
         super().__init__()
         self.db_password = db_password
         self.num_rounds = num_rounds
         self.num_clients = num_clients
+        # Worker processes for client training (1 = sequential, 0 = one per CPU core)
+        if num_workers is None:
+            num_workers = int(os.getenv('FL_TRAIN_WORKERS', 1))
+        self.num_workers = num_workers or None
+        # Local training per round (see FLClient); the defaults take one full-batch step
+        self.client_config = {
+            "epochs": int(os.getenv('FL_LOCAL_EPOCHS', 1)),
+            "batch_size": int(os.getenv('FL_BATCH_SIZE', 0)) or None,
+            "learning_rate": float(os.getenv('FL_LEARNING_RATE', 0.5)),
+            "lr_decay": float(os.getenv('FL_LR_DECAY', 0.0)),
+            # Upload compressed deltas instead of full weights: none, int8, topk or topk+int8
+            "update_codec": os.getenv('FL_UPDATE_CODEC') or None,
+            "topk_ratio": float(os.getenv('FL_TOPK_RATIO', 0.01)),
+        }
+        # FL_ASYNC_BUFFER=K switches to asynchronous buffered aggregation, merging every
+        # K updates as they arrive (0 = synchronous rounds). Updates trained from a
+        # model more than FL_MAX_STALENESS versions old are dropped.
+        self.async_buffer = int(os.getenv('FL_ASYNC_BUFFER', 0))
+        self.max_staleness = int(os.getenv('FL_MAX_STALENESS', 10))
         self.should_stop = False
 
     def log(self, message):
@@ -43,18 +92,19 @@ class SimulationRunner(threading.Thread):
         timestamp = datetime.now(tz).strftime("%H:%M:%S")
         log_entry = f"[{timestamp}] {message}"
         print(log_entry)
-        simulation_state["logs"].append(log_entry)
-        # Keep only last 100 logs
-        if len(simulation_state["logs"]) > 100:
-            simulation_state["logs"].pop(0)
+        add_log(log_entry)
 
-    def run(self):
-        global simulation_state
-        simulation_state["status"] = "RUNNING"
+    def reset_state(self):
+        """Clears simulation_state for a new run and publishes it as a reset event"""
         simulation_state["total_rounds"] = self.num_rounds
         simulation_state["current_round"] = 0
         simulation_state["metrics"] = {"rounds": [], "accuracy": [], "loss": []}
-        simulation_state["logs"] = []
+        simulation_state["logs"].clear()
+        set_status("RUNNING")
+        events.publish("reset", snapshot())
+
+    def run(self):
+        self.reset_state()
 
         try:
             self.log("Initializing Simulation...")
@@ -107,12 +157,12 @@ class SimulationRunner(threading.Thread):
             for i in range(self.num_clients):
                 self.log(f"Initializing Client {i+1}...")
                 try:
-                    c = FLClient(f"client_{i+1}", client_partitions[i], processor, shared_key)
+                    c = FLClient(f"client_{i+1}", client_partitions[i], processor, shared_key, **self.client_config)
                     clients.append(c)
                     
                     # SAVE DATASET FOR WEB APP PREVIEW
-                    # client_partitions[i] is ALREADY text string from partition_data
-                    client_text = client_partitions[i] 
+                    # client_partitions[i] is an encoded view from partition_data
+                    client_text = processor.decode(client_partitions[i])
                     
                     client_file_path = os.path.join(datasets_dir, f"client_{i+1}.txt")
                     with open(client_file_path, "w", encoding="utf-8") as f:
@@ -125,14 +175,13 @@ class SimulationRunner(threading.Thread):
             # Save Global Test Set too
             self.log("Creating Global Test Set...")
             try:
-                # create_dataset returns indices, but partitions are text strings. 
-                # We need input text for create_dataset.
+                # create_dataset accepts the encoded partitions directly.
                 test_X_ind, test_y = processor.create_dataset(client_partitions[0][-200:])
                 
                 # Save a snippet of original text as "global.txt"
-                # Processor.text contains the full text
+                # Processor.encoded holds the full (memory-mapped) corpus
                 with open(os.path.join(datasets_dir, "global_shakespeare.txt"), "w", encoding="utf-8") as f:
-                    f.write(processor.text[:5000]) # First 5000 chars of actual text
+                    f.write(processor.decode(processor.encoded[:5000])) # First 5000 chars of actual text
                 self.log("Global Test Set created.")
             except Exception as e:
                 self.log(f"Error creating global test set: {e}")
@@ -140,64 +189,29 @@ class SimulationRunner(threading.Thread):
             
             # 5. Server
             self.log("Initializing Server...")
-            server = FLServer(processor.vocab_size, processor.seq_length, db, shared_key)
+            # MODEL_DTYPE=float64 trades twice the memory and update size for the original numerics
+            server = FLServer(processor.vocab_size, processor.seq_length, db, shared_key,
+                              dtype=os.getenv('MODEL_DTYPE', 'float32'),
+                              buffer_size=self.async_buffer or None, max_staleness=self.max_staleness)
             server.register_clients(clients)
             self.log("Server initialized.")
             
             # Test Data
-            test_X_ind, test_y = processor.create_dataset(client_partitions[0][-200:])
-            test_X = processor.one_hot_encode(test_X_ind)
+            test_X, test_y = processor.create_dataset(client_partitions[0][-200:]) # Index inputs
 
+            # Binary checkpoints, mostly stored as deltas against the previous round.
+            # CHECKPOINT_DTYPE=float16 halves them again at some precision cost.
+            checkpoint_writer = CheckpointWriter(dtype=os.getenv('CHECKPOINT_DTYPE') or None)
+            
             # 6. Loop
-            for r in range(1, self.num_rounds + 1):
-                if self.should_stop:
-                    break
-                    
-                simulation_state["current_round"] = r
-                self.log(f"--- Starting Round {r} ---")
-                
-                round_id = db.start_round()
-                curr_W, curr_b = server.global_model.get_parameters()
-                
-                # Client Steps
-                for client in clients:
-                    self.log(f"Client {client.client_id}: Training & Encrypting...")
-                    update_pkg = client.train_round(curr_W, curr_b)
-                    
-                    db.store_update(
-                        round_id, 
-                        update_pkg["client_id"],
-                        update_pkg["encrypted_data"],
-                        update_pkg["nonce"],
-                        update_pkg["tag"],
-                        update_pkg["signature"]
-                    )
-                    time.sleep(0.5) # Artificial delay for visual effect in UI
-                
-                # Server Steps
-                self.log("Server: Aggregating & Updating Global Model...")
-                server.aggregate_updates(round_id)
-                
-                # Evaluate
-                loss, accuracy = server.evaluate(test_X, test_y)
-                self.log(f"Round {r} Complete. Loss: {loss:.4f}, Accuracy: {accuracy:.4f}")
-                
-                # Update Metrics
-                simulation_state["metrics"]["rounds"].append(r)
-                simulation_state["metrics"]["loss"].append(float(loss)) 
-                simulation_state["metrics"]["accuracy"].append(float(accuracy))
-
-                # Save Global Model Checkpoint to DB
-                db.store_global_model(
-                    round_id, 
-                    server.global_model.to_json(), 
-                    float(accuracy)
-                )
-                
-                time.sleep(1) # Delay between rounds
+            if self.async_buffer:
+                self.run_async(db, server, clients, test_X, test_y, checkpoint_writer)
+            else:
+                trainer = make_client_trainer(clients, self.num_workers)
+                self.run_rounds(db, server, trainer, test_X, test_y, checkpoint_writer)
 
             self.log("Simulation Completed Successfully.")
-            simulation_state["status"] = "COMPLETED"
+            set_status("COMPLETED")
             db.close()
             
         except Exception as e:
@@ -208,14 +222,161 @@ class SimulationRunner(threading.Thread):
             import traceback
             traceback.print_exc()
             
-            simulation_state["status"] = "ERROR"
             # Sanitize error for frontend display if needed, but usually str(e) is fine.
             # If it's very long, maybe truncate?
-            simulation_state["error_details"] = error_msg if len(error_msg) < 200 else error_msg[:200] + "..."
+            set_status("ERROR", error_msg if len(error_msg) < 200 else error_msg[:200] + "...")
         finally:
+            if 'trainer' in locals():
+                trainer.close()
             if 'db' in locals() and db:
                 db.close()
 
+    def run_rounds(self, db, server, trainer, test_X, test_y, checkpoint_writer):
+        """Synchronous FedAvg: every client trains on the same model, then the round is aggregated"""
+        if self.num_workers != 1:
+            self.log(f"Training clients in parallel across {trainer.num_workers} workers.")
+        for r in range(1, self.num_rounds + 1):
+            if self.should_stop:
+                break
+                
+            simulation_state["current_round"] = r
+            events.publish("round", {"current_round": r, "total_rounds": self.num_rounds})
+            self.log(f"--- Starting Round {r} ---")
+            
+            # The round is committed on its own; other writers (client registration,
+            # /api/v1/updates) are only blocked for the short transaction below
+            round_id = db.start_round()
+            curr_W, curr_b = server.global_model.get_parameters()
+            
+            # Client Steps (results arrive as each client finishes)
+            updates = []
+            for update_pkg in trainer.train_round(curr_W, curr_b, round_id):
+                self.log(f"Client {update_pkg['client_id']}: Trained & Encrypted update.")
+                updates.append((
+                    round_id,
+                    update_pkg["client_id"],
+                    update_pkg["encrypted_data"],
+                    update_pkg["nonce"],
+                    update_pkg["tag"],
+                    update_pkg["signature"]
+                ))
+                time.sleep(0.5) # Artificial delay for visual effect in UI
+            
+            # The round's updates, aggregate and checkpoint are committed together
+            with db.round_transaction():
+                db.store_updates_bulk(updates)
+                
+                # Server Steps
+                self.log("Server: Aggregating & Updating Global Model...")
+                server.aggregate_updates(round_id)
+                
+                # Evaluate
+                loss, accuracy = server.evaluate(test_X, test_y)
+                self.log(f"Round {r} Complete. Loss: {loss:.4f}, Accuracy: {accuracy:.4f}")
+                
+                self.record_metrics(r, loss, accuracy)
+                self.store_checkpoint(db, server, checkpoint_writer, round_id, accuracy)
+            
+            time.sleep(1) # Delay between rounds
+
+    def run_async(self, db, server, clients, test_X, test_y, checkpoint_writer):
+        """Asynchronous buffered aggregation (see FLServer.receive_update).
+
+        Each client trains in its own thread, starting again from the newest model as
+        soon as its update is handed over, so a slow client never holds up the rest.
+        This thread is the only one touching the DB and the server: it records each
+        update in the ledger under the round the client started in, buffers it, and
+        after every merge evaluates, checkpoints and opens the next round. Client
+        training runs in threads here; FL_TRAIN_WORKERS only applies to synchronous rounds.
+        """
+        arrivals = queue.Queue()
+        stop = threading.Event()
+        # (W, b, model_version, round_id) clients start from; replaced, never mutated
+        latest = {}
+        
+        def open_round(r):
+            round_id = db.start_round()
+            W, b = server.global_model.get_parameters()
+            latest["model"] = (W, b, server.model_version, round_id)
+            simulation_state["current_round"] = r
+            events.publish("round", {"current_round": r, "total_rounds": self.num_rounds})
+            self.log(f"--- Round {r}: model version {server.model_version} ---")
+            return round_id
+        
+        def evaluate_merge(r):
+            loss, accuracy = server.evaluate(test_X, test_y)
+            stats = server.last_merge_stats
+            self.log(f"Round {r} Complete ({stats['updates']} updates, mean staleness "
+                     f"{stats['mean_staleness']:.2f}). Loss: {loss:.4f}, Accuracy: {accuracy:.4f}")
+            self.record_metrics(r, loss, accuracy)
+            return accuracy
+        
+        def client_loop(client):
+            while not stop.is_set():
+                W, b, version, round_id = latest["model"]
+                try:
+                    update_pkg = client.train_round(W, b, round_id)
+                except Exception as e:
+                    arrivals.put(("error", client.client_id, e, None))
+                    return
+                arrivals.put(("update", update_pkg, version, round_id))
+                time.sleep(0.5) # Artificial delay for visual effect in UI
+        
+        self.log(f"Asynchronous aggregation: merging every {server.buffer_size} updates.")
+        r = 1
+        round_id = open_round(r)
+        threads = [threading.Thread(target=client_loop, args=(c,), daemon=True) for c in clients]
+        for t in threads:
+            t.start()
+        try:
+            while r <= self.num_rounds and not self.should_stop:
+                try:
+                    kind, payload, version, update_round_id = arrivals.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if kind == "error":
+                    raise RuntimeError(f"Client {payload} failed: {version}")
+                
+                db.store_update(update_round_id, payload["client_id"], payload["encrypted_data"],
+                                payload["nonce"], payload["tag"], payload["signature"])
+                self.log(f"Client {payload['client_id']}: update from model version {version} "
+                         f"(staleness {server.model_version - version}).")
+                if not server.receive_update(payload, version, update_round_id):
+                    continue
+                
+                accuracy = evaluate_merge(r)
+                with db.round_transaction():
+                    self.store_checkpoint(db, server, checkpoint_writer, round_id, accuracy)
+                    r += 1
+                    if r <= self.num_rounds:
+                        round_id = open_round(r)
+            
+            # Stopped early: merge the updates already buffered instead of dropping them
+            if server.flush_buffer():
+                accuracy = evaluate_merge(r)
+                self.store_checkpoint(db, server, checkpoint_writer, round_id, accuracy)
+        finally:
+            stop.set()
+            for t in threads:
+                t.join(timeout=5)
+
+    def record_metrics(self, r, loss, accuracy):
+        simulation_state["metrics"]["rounds"].append(r)
+        simulation_state["metrics"]["loss"].append(float(loss)) 
+        simulation_state["metrics"]["accuracy"].append(float(accuracy))
+        events.publish("metrics", {"round": r, "loss": float(loss), "accuracy": float(accuracy)})
+
+    def store_checkpoint(self, db, server, checkpoint_writer, round_id, accuracy):
+        """Saves the global model to the DB, mostly as a delta against the previous checkpoint"""
+        new_W, new_b = server.global_model.get_parameters()
+        checkpoint, base_round_id = checkpoint_writer.encode(new_W, new_b, round_id)
+        db.store_global_model(
+            round_id, 
+            checkpoint, 
+            float(accuracy),
+            base_round_id=base_round_id
+        )
+
     def stop(self):
         self.should_stop = True
 
@@ -237,5 +398,5 @@ def stop_simulation():
         runner_thread.stop()
     
     # Force status update so UI doesn't get stuck
-    simulation_state["status"] = "IDLE"
-    simulation_state["logs"].append("[System] Simulation forced stop.")
+    set_status("IDLE")
+    add_log("[System] Simulation forced stop.")
@@ -0,0 +1,176 @@
+import queue
+import threading
+import time
+
+from src.metrics import REGISTRY
+from src.storage import Error
+
+_ACCEPTED = REGISTRY.counter("fl_update_queue_accepted_total", "Updates queued for the ledger").labels()
+_REJECTED = REGISTRY.counter("fl_update_queue_rejected_total", "Updates refused because the queue was full").labels()
+_WRITTEN = REGISTRY.counter("fl_update_queue_written_total", "Queued updates stored in the ledger").labels()
+_FAILED = REGISTRY.counter("fl_update_queue_failed_total", "Queued updates the ledger refused").labels()
+_RETRIES = REGISTRY.counter("fl_update_queue_retries_total", "Ledger writes retried after a transient error").labels()
+_BATCH_ROWS = REGISTRY.histogram(
+    "fl_update_queue_batch_rows", "Rows per ledger write", buckets=(1, 2, 4, 8, 16, 32, 64, 128)).labels()
+
+# Wakes the writer at close(); it also polls, in case the queue was too full for this
+_STOP = object()
+_POLL_SECONDS = 0.5
+
+
+class UpdateWriter:
+    """Write-behind buffer between the update endpoint and the ledger.
+
+    Requests put validated update rows on a bounded queue and return at once; one
+    background thread drains it, writing up to batch_size rows per multi-row
+    INSERT on a single pooled connection. Transient errors (lock timeouts, lost
+    connections) keep the rows and retry. If the ledger refuses a batch (a
+    constraint violation), its rows are retried one by one so only the bad rows
+    are dropped. close() stops accepting and writes everything still queued.
+    """
+    def __init__(self, open_db, max_pending=1024, batch_size=32, retry_delay=1.0):
+        # open_db() -> connected DBManager; the writer closes it after each batch
+        self.open_db = open_db
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="update-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        """Queues a (round_id, client_id, encrypted_data, nonce, tag, signature) row.
+
+        Returns False, without blocking, if the queue is full or the writer is closed.
+        """
+        if self._stopping.is_set():
+            return False
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            _REJECTED.inc()
+            return False
+        _ACCEPTED.inc()
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=30):
+        """Stops accepting updates and waits up to timeout seconds for the queue to drain"""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"Update writer: {self.pending()} updates still queued at shutdown")
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=_POLL_SECONDS)]
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            # Take whatever else is already waiting, up to a full batch
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [row for row in batch if row is not _STOP]
+            if batch:
+                self._write(batch)
+
+    def _write(self, rows):
+        pending = rows
+        stored = 0
+        row_by_row = False
+        while pending:
+            db = None
+            try:
+                db = self.open_db()
+                if not row_by_row:
+                    try:
+                        # All or nothing, so the row-by-row retry can't store a row twice
+                        with db.round_transaction():
+                            db.insert_updates(pending)
+                        stored += len(pending)
+                        pending = []
+                    except Error as e:
+                        if not db.backend.is_rejected_row(e):
+                            raise
+                        row_by_row = True
+                while pending:
+                    try:
+                        db.insert_updates(pending[:1])
+                        stored += 1
+                    except Error as e:
+                        if not db.backend.is_rejected_row(e):
+                            raise
+                        print(f"Update writer: ledger refused update from {pending[0][1]}: {e}")
+                    # Done with this row either way; a transient error above keeps it
+                    pending = pending[1:]
+            except Exception as e:
+                # Transient (lock timeout, lost connection...): keep the rows and retry
+                print(f"Update writer: ledger unavailable ({e}), retrying {len(pending)} "
+                      f"updates in {self.retry_delay}s")
+                _RETRIES.inc()
+                time.sleep(self.retry_delay)
+            finally:
+                if db:
+                    db.close()
+        _BATCH_ROWS.observe(len(rows))
+        _WRITTEN.inc(stored)
+        _FAILED.inc(len(rows) - stored)
+
+
+class UpdateRefs:
+    """Cached checks that an update's client and round exist in the ledger.
+
+    Lets the endpoint refuse updates the ledger would reject before answering 202.
+    Known clients are remembered; round ids only grow, so any id up to the newest
+    one seen is known. Either cache is refreshed from the DB on a miss and dropped
+    by invalidate(table) when that table is written (e.g. by a reset).
+    """
+    def __init__(self, open_db):
+        self.open_db = open_db
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._max_round = 0
+
+    def check(self, client_id, round_id):
+        """None if both exist, else the problem as a message.
+
+        Raises the storage Error if the DB can't be asked.
+        """
+        with self._lock:
+            if client_id in self._clients and 0 < round_id <= self._max_round:
+                return None
+
+        db = self.open_db()
+        try:
+            known_client, max_round = db.get_update_refs(client_id)
+        finally:
+            db.close()
+        with self._lock:
+            if known_client:
+                self._clients.add(client_id)
+            self._max_round = max_round or 0
+        if not known_client:
+            return f"Unknown client {client_id}"
+        if not 0 < round_id <= (max_round or 0):
+            return f"Unknown round {round_id}"
+        return None
+
+    def invalidate(self, table):
+        with self._lock:
+            if table == 'clients':
+                self._clients.clear()
+            elif table == 'rounds':
+                self._max_round = 0
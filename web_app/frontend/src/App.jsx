@@ -21,10 +21,73 @@ function App() {
     const API_URL = import.meta.env.VITE_BACKEND_URL || import.meta.env.VITE_API_URL ||
         (window.location.hostname === 'localhost' ? 'http://localhost:5000' : 'https://secure-fl-backend.onrender.com');
 
-    // Polling for Dashboard Data
+    const MAX_LOGS = 100;
+
+    const applySnapshot = (state) => {
+        setStatus(state.status);
+        setLogs(state.logs?.slice().reverse() || []);
+
+        if (state.error_details) {
+            setErrorDetails(state.error_details);
+        } else if (state.status !== "ERROR") {
+            setErrorDetails(null);
+        }
+
+        if (state.metrics && state.metrics.loss) {
+            const chartData = state.metrics.rounds.map((r, i) => ({
+                round: r,
+                loss: state.metrics.loss[i],
+                accuracy: state.metrics.accuracy ? state.metrics.accuracy[i] : 0
+            }));
+            setMetrics(chartData);
+        }
+    };
+
+    const fetchLedger = async () => {
+        try {
+            const ledgerRes = await axios.get(`${API_URL}/api/ledger`);
+            setLedger(ledgerRes.data);
+        } catch (err) {
+            console.error("Ledger Error:", err?.message);
+        }
+    };
+
+    // Live updates over Server-Sent Events; falls back to polling if the stream is refused
     useEffect(() => {
-        const interval = setInterval(fetchData, 1000);
-        return () => clearInterval(interval);
+        let interval = null;
+        const source = new EventSource(`${API_URL}/api/v1/events`);
+
+        const onState = (e) => applySnapshot(JSON.parse(e.data));
+        source.addEventListener('snapshot', onState);
+        source.addEventListener('reset', onState);
+        source.addEventListener('log', (e) => {
+            const { message } = JSON.parse(e.data);
+            setLogs((prev) => [message, ...prev].slice(0, MAX_LOGS));
+        });
+        source.addEventListener('status', (e) => {
+            const { status, error_details } = JSON.parse(e.data);
+            setStatus(status);
+            setErrorDetails(error_details || null);
+        });
+        source.addEventListener('metrics', (e) => {
+            const { round, loss, accuracy } = JSON.parse(e.data);
+            setMetrics((prev) => [...prev, { round, loss, accuracy }]);
+            fetchLedger();
+        });
+        source.onerror = () => {
+            // The browser retries dropped streams itself; CLOSED means it gave up
+            if (source.readyState === EventSource.CLOSED && !interval) {
+                interval = setInterval(fetchData, 1000);
+            }
+        };
+
+        fetchLedger();
+        const ledgerInterval = setInterval(fetchLedger, 10000);
+        return () => {
+            source.close();
+            clearInterval(ledgerInterval);
+            if (interval) clearInterval(interval);
+        };
     }, []);
 
     const fetchData = async () => {
@@ -34,23 +97,7 @@ function App() {
             const statusUrl = API_URL.includes('localhost') ? 'http://localhost:5000/api/status' : `${API_URL}/api/status`;
 
             const statusRes = await axios.get(statusUrl);
-            setStatus(statusRes.data.status);
-            setLogs(statusRes.data.logs?.slice().reverse() || []);
-
-            if (statusRes.data.error_details) {
-                setErrorDetails(statusRes.data.error_details);
-            } else if (statusRes.data.status !== "ERROR") {
-                setErrorDetails(null);
-            }
-
-            if (statusRes.data.metrics && statusRes.data.metrics.loss) {
-                const chartData = statusRes.data.metrics.rounds.map((r, i) => ({
-                    round: r,
-                    loss: statusRes.data.metrics.loss[i],
-                    accuracy: statusRes.data.metrics.accuracy ? statusRes.data.metrics.accuracy[i] : 0
-                }));
-                setMetrics(chartData);
-            }
+            applySnapshot(statusRes.data);
 
             const ledgerRes = await axios.get(`${API_URL}/api/ledger`);
             setLedger(ledgerRes.data);
@@ -8,7 +8,7 @@ const Models = () => {
     const API_URL = import.meta.env.VITE_API_URL || 'https://secure-fl-backend.onrender.com';
 
     useEffect(() => {
-        axios.get(`${API_URL}/api/v1/model`)
+        axios.get(`${API_URL}/api/v1/model/info`)
             .then(res => setModelInfo(res.data))
             .catch(err => console.error(err));
 